@@ -12,7 +12,7 @@
 #
 #   "pre_commit_hook": "pre-commit-hook-static-dba-files.sh"
 #
-# Last modified: 16 July 2014
+# Last modified: 18 October 2026
 
 
 # Utility function to write to stderr
@@ -39,61 +39,23 @@ ensure() {
 
 HOOK_DIR="$( cd "$(dirname "$0")" ; pwd -P  )"
 ORIG_DIR="$HOOK_DIR/../.."
-cd $ORIG_DIR
+cd "$ORIG_DIR"
 
-STAGED_FILES=$(cd $ORIG_DIR && git diff --cached --name-only --relative --diff-filter=ACMR)
+# A single run of gen-sql writes the static up and down files of all the
+# staged alters, and prints their names (one per line).
+STATIC_FILES=$(schema gen-sql --staged)
+ensure "Generate static alters for the staged files"
 
-STATIC_ALTER_DIR=$(/usr/bin/env python2.7 -c "import json; print json.loads(open('config.json').read())['static_alter_dir']")
-
-if [[ $? -ne 0 ]]
+if [[ -z "$STATIC_FILES" ]]
 then
-  echoerr 'No static_alter_dir property found in config.json, but is required.'
-  exit 1
+  exit 0
 fi
 
-# Remove the .sql files in the static alter directory from the diff output
-STAGED_FILES_SQL_ONLY=$(echo "$STAGED_FILES" | grep -v "$STATIC_ALTER_DIR" | grep -E '\.sql')
-SEEN=()
-
-for f in $STAGED_FILES_SQL_ONLY
+# One path per line, each quoted so that spaces or glob characters are kept
+while IFS= read -r f
 do
-  NODE=$(grep -oE '^[0-9]+' <(echo $(basename $f)))
-  if [[ $? -ne 0 ]]
-  then
-    echo "Skipping invalid filename: $(basename $f)" 1>&2
-    continue
-  fi
-
-  SKIP=0
-  for var in "${SEEN[@]}"
-  do
-    if [[ "${var}" == "$NODE" ]]
-    then
-      SKIP=1
-    fi
-  done
-
-  if [[ $SKIP -eq 1 ]]
-  then
-    continue
-  fi
-
-
-  SEEN+=($NODE)
-
-  UP_RESULT=$(schema gen-sql -q -w $NODE)
-  ensure "Generate UP alter for $NODE"
-
-  DOWN_RESULT=$(schema gen-sql -q -w -d $NODE)
-  ensure "Generate DOWN alter for $NODE"
-
-  # Add the up and down files to git
-  ADD_UP=$(cd $ORIG_DIR && git add "$UP_RESULT")
-  ensure "Add $UP_RESULT to git"
-
-  ADD_DOWN=$(cd $ORIG_DIR && git add "$DOWN_RESULT")
-  ensure "Add $DOWN_RESULT to git"
+  ADD=$(cd "$ORIG_DIR" && git add -- "$f")
+  ensure "Add $f to git"
 
-  echo "Added file to commit (up):   $UP_RESULT"
-  echo "Added file to commit (down): $DOWN_RESULT"
-done
+  echo "Added file to commit: $f"
+done <<< "$STATIC_FILES"
@@ -7,6 +7,8 @@ from resolve import ResolveCommand
 from list    import ListCommand
 from up      import UpCommand
 from down    import DownCommand
+from plan    import PlanCommand
 from rebuild import RebuildCommand
 from gen_sql import GenSqlCommand
 from init    import InitCommand
+from fleet   import FleetRunner
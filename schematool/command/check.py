@@ -16,25 +16,26 @@ class CheckCommand(Command):
         parser.add_option('-v', '--verbose',
                           action='store_true', dest='verbose', default=False,
                           help='Enable verbose message output')
+        self.add_jobs_option(parser)
         self.parser = parser
 
-    def run(self, inline=False):
+    def run(self, inline=False, jobs=None):
         """
-        Check that the alter chain is valid
-
+        Check that the alter chain is valid. When run inline (from another
+        command) options are not parsed and jobs is used instead.
         """
         # TODO  Check that the alter chain is in line with the DB (but not necessarily up to date)
         # TODO  Make the verbose flag do something based on previous additions
         # TODO  Add flags to only perform certain checks (as described in the other todos)
 
         if not inline:
-            # (options, args) = self.parser.parse_args()
-            self.parser.parse_args()
+            (options, _) = self.parser.parse_args()
+            jobs = options.jobs
 
         self.files = ChainUtil.get_alter_files()
 
         # implicitly check validity of chain (integrity check)
-        chain = ChainUtil.build_chain()
+        chain = ChainUtil.build_chain(jobs=jobs)
 
         # all other checks
         self.check_abandoned_alters(chain)
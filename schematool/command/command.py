@@ -13,3 +13,11 @@ class Command(object):
         Initialize all option-parsing stuff and store into self.parser
         """
         pass
+
+    def add_jobs_option(self, parser, help=None):
+        """
+        Add the -j/--jobs option, shared by all commands that build the chain
+        """
+        parser.add_option('-j', '--jobs',
+                          action='store', type='int', dest='jobs', default=None,
+                          help=help or 'Number of threads used to read alter files when building the chain')
@@ -1,6 +1,7 @@
 # local imports
-from db import MySQLDb, PostgresDb, MemoryDb, VerticaDb, HiveDb
+from db import ConnectionPool, MySQLDb, PostgresDb, MemoryDb, VerticaDb, HiveDb
 from errors import InvalidDBTypeError
+from util import ChainUtil
 
 class CommandContext(object):
     """
@@ -36,6 +37,9 @@ class CommandContext(object):
         else:
             db = MySQLDb.new(config)
 
+        ChainUtil.configure(config)
+        ConnectionPool.configure(config)
+
         return CommandContext(config, db)
 
     @staticmethod
@@ -0,0 +1,189 @@
+# stdlib imports
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from traceback import format_exc
+
+# local imports
+from context import CommandContext
+from db import ConnectionPool
+from down import DownCommand
+from errors import ConfigFileError, FleetError
+from list import ListCommand
+from plan import PlanCommand
+from up import UpCommand
+
+HANDLERS = {
+    'UpCommand': UpCommand,
+    'DownCommand': DownCommand,
+    'ListCommand': ListCommand,
+    'PlanCommand': PlanCommand
+}
+
+class FleetRunner(object):
+    """
+    Runs a command against every target of the 'fleet' config, up to
+    '--parallel' of them at once. Each target is run in its own process, as
+    commands take their arguments from (and write to) the global sys
+    module, with its output prefixed by the name of the target as it is
+    written. A failing target doesn't stop the others;
+    a summary is given at the end.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.targets = self.load_targets(config['fleet'])
+
+    @staticmethod
+    def load_targets(fleet):
+        """
+        Given the 'fleet' config value (a list of targets, or the name of a
+        JSON file holding the list), return a list of (name, overrides) tuples.
+        Each target is a dictionary of config values that override the base
+        config, optionally with a 'name' used in the output.
+        """
+        if isinstance(fleet, basestring):
+            try:
+                fleet_file = open(fleet)
+                try:
+                    fleet = json.load(fleet_file)
+                finally:
+                    fleet_file.close()
+            except (IOError, ValueError), ex:
+                raise ConfigFileError("Could not read fleet file '%s': %s\n" % (fleet, ex))
+
+        if not isinstance(fleet, list) or not fleet or not all(isinstance(t, dict) for t in fleet):
+            raise ConfigFileError("'fleet' must be a non-empty list of targets (objects) or the name of a file holding one")
+
+        targets = []
+        names = set()
+        for target in fleet:
+            if target.get('name'):
+                if target['name'] in names:
+                    raise ConfigFileError("Fleet target name '%s' is used more than once" % target['name'])
+                names.add(target['name'])
+            name = target.get('name') or '%s/%s' % (target.get('host', ''), target.get('db_name', ''))
+            targets.append((str(name), target))
+        return targets
+
+    def configs(self):
+        """
+        Return a list of (name, config) tuples, one per target, the config
+        being the base config with the target's overrides applied
+        """
+        configs = []
+        for (name, overrides) in self.targets:
+            config = dict(self.config)
+            del config['fleet']
+            config.update(overrides)
+            configs.append((name, config))
+        return configs
+
+    def validate_configs(self):
+        """
+        Check the config of every target (see CommandContext.validate_config),
+        returning the errors found prefixed with the name of the target
+        """
+        return ['[%s] %s' % (name, error) for (name, config) in self.configs()
+                for error in CommandContext.validate_config(config)]
+
+    def run(self, handler, argv, parallel=None):
+        """
+        Run the command (given by the name of its handler) with the given
+        arguments against all targets.
+
+        Returns a list of (name, success, result) tuples in the order of the
+        targets, result being the return value of the command or the error
+        message. Raises FleetError if any of the targets failed.
+        """
+        parallel = max(1, min(parallel or 1, len(self.targets)))
+        # targets are told apart by index, names are only for display
+        jobs = [(index, handler, config, list(argv), name)
+                for (index, (name, config)) in enumerate(self.configs())]
+
+        sys.stdout.write("Running on %d target(s), %d at a time\n" % (len(jobs), parallel))
+        sys.stdout.flush()
+
+        # one process per target, so that no state carries over between them
+        pool = multiprocessing.Pool(parallel, maxtasksperchild=1)
+        try:
+            results = {}
+            for (index, name, success, result) in pool.imap_unordered(_run_target, jobs):
+                results[index] = (name, success, result)
+                sys.stdout.write("[%s] %s\n" % (name, 'done' if success else 'FAILED'))
+                sys.stdout.flush()
+        finally:
+            pool.close()
+            pool.join()
+
+        results = [results[index] for index in range(len(jobs))]
+        failed = [(name, result) for (name, success, result) in results if not success]
+        sys.stdout.write("\nFleet summary: %d succeeded, %d failed\n" % (
+            len(results) - len(failed), len(failed)))
+        if failed:
+            raise FleetError("failed on %d target(s):\n%s" % (
+                len(failed), "\n".join("  %s: %s" % (name, error) for (name, error) in failed)))
+        return results
+
+
+def _run_target(job):
+    """
+    Run a command against a single target (in a pool process)
+    """
+    (index, handler, config, argv, name) = job
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = _PrefixedStream(stdout, name)
+    sys.stderr = _PrefixedStream(stderr, name)
+    sys.argv = argv
+    # idle connections inherited from the parent process are its own
+    ConnectionPool.reset()
+    try:
+        context = CommandContext.via(config)
+        try:
+            result = HANDLERS[handler](context).run()
+            context.db.flush_commits()
+        finally:
+            context.db.flush_commits(quiet=True)
+            context.db.close()
+        return (index, name, True, result)
+    except Exception, ex:
+        if ex.__class__.__module__ != 'errors':
+            sys.stderr.write(format_exc())
+        return (index, name, False, ' '.join(str(arg).strip() for arg in ex.args) or repr(ex))
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+class _PrefixedStream(object):
+    """
+    File-like object writing whole lines to the given stream, each prefixed
+    with the name of a target, so that the output of targets run at the same
+    time isn't interleaved within lines
+    """
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.prefix = '[%s] ' % name
+        self.buffer = ''
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            self.buffer += data
+            if '\n' in self.buffer:
+                lines, self.buffer = self.buffer.rsplit('\n', 1)
+                self.__write_lines(lines)
+
+    def flush(self):
+        with self.lock:
+            if self.buffer:
+                self.__write_lines(self.buffer)
+                self.buffer = ''
+
+    def __write_lines(self, lines):
+        out = ''.join('%s%s\n' % (self.prefix, line) for line in lines.split('\n'))
+        # a single write per batch of lines, which the OS doesn't interleave
+        # with other processes' writes for reasonably sized output
+        os.write(self.stream.fileno(), out)
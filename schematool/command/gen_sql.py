@@ -1,13 +1,25 @@
 # stdlib imports
+from itertools import imap
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
+import copy
+import hashlib
+import json
 import os
+import re
+import subprocess
 import sys
+import tarfile
+import tempfile
+import time
+import zipfile
 
 # local imports
 from command import Command
 from constants import Constants
-from errors import MissingRefError, ReadError
-from util import ChainUtil
+from errors import MissingRefError, OptionsError, ReadError
+from node import ChainArray
+from util import ChainUtil, StaticManifest
 
 class GenSqlCommand(Command):
     """
@@ -19,6 +31,16 @@ class GenSqlCommand(Command):
 
     # TODO@jmurray - is the comment about transaction free-time still relevant?
     """
+    # size of the blocks alter files are read and written in
+    BLOCK_SIZE = 64 * 1024
+    # default location of the manifest of 'gen-sql --sync' (see 'static_manifest')
+    MANIFEST_FILENAME = '.schema-tool-static-manifest'
+    # mode of the static files, as open() would create them (see __file_mode)
+    file_mode = None
+    # tarfile modes of the supported --bundle formats (None for zip), by extension
+    BUNDLE_FORMATS = [('.tar.gz', 'w:gz'), ('.tgz', 'w:gz'), ('.tar.bz2', 'w:bz2'),
+                      ('.tar', 'w'), ('.zip', None)]
+
     def init_parser(self):
         usage = ("schema gen-sql [options] [ref [ref [...]]]\n"
                  "       If no refs are specified, all refs will be used.")
@@ -40,7 +62,23 @@ class GenSqlCommand(Command):
                           help=('Do not print to stdout.  Instead, write SQL to file in '
                                 '\'static_alter_dir\' directory from config.json.  Implies '
                                 '-q/--include-rev-query'))
+        parser.add_option('-s', '--sync',
+                          action='store_true', dest='sync', default=False,
+                          help=('Bring \'static_alter_dir\' up to date with the whole chain: '
+                                'write the up and down files of new or changed alters only, and '
+                                'remove those of alters that are gone.  Implies -w'))
+        parser.add_option('--staged',
+                          action='store_true', dest='staged', default=False,
+                          help=('Write the up and down files of every alter staged in git to '
+                                '\'static_alter_dir\' (as used by the pre-commit hook).  Implies -w'))
+        parser.add_option('-b', '--bundle',
+                          action='store', dest='bundle', default=None, metavar='FILE',
+                          help=('Write the up and down SQL of the refs, with revision queries, to a '
+                                'single archive (.tar.gz, .tgz, .tar.bz2, .tar or .zip) along with a '
+                                'manifest.json listing the alters in order'))
 
+        self.add_jobs_option(parser, help=('Number of threads used to read alter files when building '
+                                           'the chain, and to write static files with -w'))
         self.parser = parser
 
     def _setup_static_alter_dir(self):
@@ -52,6 +90,26 @@ class GenSqlCommand(Command):
     def run(self):
         (options, args) = self.parser.parse_args()
 
+        if options.sync:
+            if args or options.down_alter:
+                raise OptionsError('-s/--sync works on the up and down files of the whole chain, '
+                                   'it does not take refs or -d/--down', self.parser.format_help())
+            options.write_to_file = True
+
+        if options.staged:
+            if args or options.down_alter:
+                raise OptionsError('--staged works on the up and down files of the staged alters, '
+                                   'it does not take refs or -d/--down', self.parser.format_help())
+            options.write_to_file = True
+
+        if options.bundle:
+            if options.down_alter or options.write_to_file:
+                raise OptionsError('-b/--bundle holds both up and down SQL, it can not be combined '
+                                   'with -d/--down or -w/--write-to-file', self.parser.format_help())
+            if self.__bundle_mode(options.bundle) is False:
+                raise OptionsError('unsupported bundle format: %s' % options.bundle, self.parser.format_help())
+            options.include_rev_query = True
+
         # validate static_alter_dir set if flag used
         if options.write_to_file:
             options.include_rev_query = True
@@ -61,105 +119,409 @@ class GenSqlCommand(Command):
             self._setup_static_alter_dir()
 
         refs = args
-        nodes = ChainUtil.build_chain()
+        chain = ChainArray(ChainUtil.build_chain(jobs=options.jobs))
         ref_nodes = []
 
+        if options.sync:
+            return self.sync_static_alter_dir(chain, options)
+        if options.staged:
+            return self.write_staged_static_files(chain, options)
+
         if len(refs) == 0:
             # entire chain
-            refs = self._get_node_ids(nodes)
-            refs.reverse()
+            refs = chain.ids
 
         # validate valid refs
         for ref in refs:
-            node = self._find_ref(ref, nodes)
-            if node is False:
+            node = chain.find(ref)
+            if node is None:
                 raise MissingRefError("Ref '%s' could not be found" % ref, self.parser.format_help())
             else:
                 ref_nodes.append(node)
 
+        if options.bundle:
+            return self.write_bundle(chain, ref_nodes, options)
+
         # gen SQL for each ref
         if options.write_to_file:
-            # gen SQL for each ref, and save to individual files.
+            # gen SQL for each ref, and save to individual files. A ref given
+            # twice is written once (in the order given), as two threads would
+            # write the same file.
+            work = []
+            seen = set()
             for node in ref_nodes:
-                sql = self.gen_sql_for_reflist([node], options)
-                if options.down_alter:
-                    filename = node.down_filename()
-                else:
-                    filename = node.filename
-                fobj = open(os.path.join(self.config['static_alter_dir'], filename), 'w')
-                fobj.write(sql)
-                fobj.close()
-                print os.path.join(self.config['static_alter_dir'], filename)
+                if node.id not in seen:
+                    seen.add(node.id)
+                    work.append((node, options))
+            self._write_static_files(work, options.jobs)
         else:
-            # gen SQL for refs in one call
-            sql = self.gen_sql_for_reflist(ref_nodes, options)
-            sys.stdout.write(sql)
+            # gen SQL for refs in one go
+            for chunk in self.gen_sql_for_reflist(ref_nodes, options):
+                sys.stdout.write(chunk)
 
-    def _get_node_ids(self, nodes):
-        result = []
-        tail = nodes
-        while tail is not None:
-            result.append(tail.id)
-            tail = tail.backref
-        return result
+    def write_bundle(self, chain, ref_nodes, options):
+        """
+        Write the up and down SQL of the given nodes (as with -w) to a single
+        archive, in chain order, along with a manifest.json that lists for
+        each alter its ref, backref, environment constraints and the name,
+        size and sha256 checksum of its up and down files. The archive is
+        written under a temporary name and renamed into place.
 
-    def _find_ref(self, ref, nodes):
+        Returns the manifest
         """
-        Given a revision (from the command line), check to see if it exists within
-        the set of nodes (working backwards). If it does, return the node, else false.
+        ref_nodes = sorted(set(ref_nodes), key=lambda node: chain.index(node.id))
+        manifest = {
+            'version': 1,
+            'generated': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'type': self.config.get('type'),
+            'alters': []
+        }
+
+        mode = self.__bundle_mode(options.bundle)
+        tmp_filename = '%s.%s.tmp' % (options.bundle, os.getpid())
+        if mode is None:
+            archive = zipfile.ZipFile(tmp_filename, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        else:
+            archive = tarfile.open(tmp_filename, mode)
+        try:
+            try:
+                for node in ref_nodes:
+                    alter = {
+                        'ref': node.id,
+                        'backref': node.backref.id if node.backref is not None else None,
+                        'require_env': node.require_env,
+                        'skip_env': node.skip_env
+                    }
+                    for (direction, filename) in (('up', node.filename), ('down', node.down_filename())):
+                        node_options = copy.copy(options)
+                        node_options.down_alter = (direction == 'down')
+                        alter[direction] = self.__add_to_bundle(archive, '%s/%s' % (direction, filename),
+                                                                self.gen_sql_for_reflist([node], node_options))
+                    manifest['alters'].append(alter)
+
+                self.__add_to_bundle(archive, 'manifest.json',
+                                     [json.dumps(manifest, indent=2, sort_keys=True) + '\n'])
+            finally:
+                archive.close()
+            os.rename(tmp_filename, options.bundle)
+        except:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+
+        print options.bundle
+        return manifest
+
+    def __add_to_bundle(self, archive, name, chunks):
+        """
+        Add a file with the given name and content (an iterable of strings)
+        to the archive. The content is spooled to a temporary file on the way,
+        since archive members have to be added whole.
+
+        Returns a dict with the name, size and sha256 checksum of the file
         """
-        tail = nodes
-        while tail is not None:
-            if tail.id == ref:
-                return tail
-            tail = tail.backref
+        digest = hashlib.sha256()
+        spool = tempfile.NamedTemporaryFile(prefix='schema-tool-bundle-')
+        try:
+            for chunk in chunks:
+                digest.update(chunk)
+                spool.write(chunk)
+            spool.flush()
+            size = spool.tell()
+
+            if isinstance(archive, zipfile.ZipFile):
+                archive.write(spool.name, name)
+            else:
+                info = archive.gettarinfo(spool.name, name)
+                info.mode = 0644
+                info.uid = info.gid = 0
+                info.uname = info.gname = ''
+                spool.seek(0)
+                archive.addfile(info, spool)
+        finally:
+            spool.close()
+        return {'file': name, 'size': size, 'sha256': digest.hexdigest()}
 
+    def __bundle_mode(self, filename):
+        """
+        Return the tarfile mode for the given bundle filename (None for a zip
+        file), or False if the format is not supported
+        """
+        for (extension, mode) in self.BUNDLE_FORMATS:
+            if filename.endswith(extension):
+                return mode
         return False
 
-    def gen_sql_for_reflist(self, ref_nodes, options):
+    def _write_static_files(self, work, jobs=None):
         """
-        Given a set of refs, generate the SQL for
+        Write the static files for the given list of (node, options) pairs,
+        printing the name of each file in order as it is written. With more
+        than one job (-j/--jobs, or 'chain_jobs' from the config), files are
+        written by a pool of threads. Either way, each file is written in full
+        before it is renamed into place.
+
+        Returns the list of static files written
         """
-        sql = ''
+        jobs = int(jobs or ChainUtil.jobs or 1)
+        # looked up before any thread is started (see __file_mode)
+        self.__file_mode()
+        pool = None
+        if jobs > 1 and len(work) > 1:
+            pool = ThreadPool(min(jobs, len(work)))
+            static_filenames = pool.imap(self._write_static_file, work, 16)
+        else:
+            static_filenames = imap(self._write_static_file, work)
+
+        written = []
+        try:
+            for static_filename in static_filenames:
+                print static_filename
+                written.append(static_filename)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        return written
 
+    def _write_static_file(self, node_options):
+        """
+        Write the static file of the given (node, options) pair to
+        'static_alter_dir'. Returns the name of the file.
+        """
+        (node, options) = node_options
+        if options.down_alter:
+            filename = node.down_filename()
+        else:
+            filename = node.filename
+        static_filename = os.path.join(self.config['static_alter_dir'], filename)
+        (fd, tmp_filename) = tempfile.mkstemp(prefix='%s.' % filename, suffix='.tmp',
+                                              dir=self.config['static_alter_dir'])
+        try:
+            fobj = os.fdopen(fd, 'w')
+            try:
+                for chunk in self.gen_sql_for_reflist([node], options):
+                    fobj.write(chunk)
+            finally:
+                fobj.close()
+            # mkstemp creates the file readable by its owner only
+            os.chmod(tmp_filename, self.__file_mode())
+            os.rename(tmp_filename, static_filename)
+        except:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        return static_filename
+
+    @classmethod
+    def __file_mode(cls):
+        """
+        Return the mode open() gives new files, given the umask. The umask can
+        only be read by setting it, which affects files created meanwhile by
+        other threads, so this is done once, when the first file is written.
+        """
+        if cls.file_mode is None:
+            umask = os.umask(0)
+            os.umask(umask)
+            cls.file_mode = 0666 & ~umask
+        return cls.file_mode
+
+    def write_staged_static_files(self, chain, options):
+        """
+        Write the static up and down files of the alters staged in git, all
+        from a single read of the index and a single build of the chain
+        (rather than a run of gen-sql per file, as the pre-commit hook used
+        to do).
+
+        Returns the list of static files written
+        """
+        staged_refs = self._staged_refs()
+        missing = staged_refs.difference(chain.ids)
+        if missing:
+            raise MissingRefError("Ref '%s' could not be found" % sorted(missing)[0], self.parser.format_help())
+
+        up_options = copy.copy(options)
+        up_options.down_alter = False
+        down_options = copy.copy(options)
+        down_options.down_alter = True
+        work = []
+        for node in chain.nodes:
+            if node.id in staged_refs:
+                work.append((node, up_options))
+                work.append((node, down_options))
+        return self._write_static_files(work, options.jobs)
+
+    def _staged_refs(self):
+        """
+        Return the set of refs of the alter files that are staged in git
+        (added, copied, modified or renamed), leaving out the static files
+        """
+        cmd = ['git', 'diff', '--cached', '--name-only', '--relative', '--diff-filter=ACMR']
+        try:
+            proc = subprocess.Popen(cmd, cwd=Constants.ALTER_DIR,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            (stdout, stderr) = proc.communicate()
+        except OSError, ex:
+            raise ReadError('Could not list the staged files with git\n\t=>%s\n' % ex)
+        if proc.returncode != 0:
+            raise ReadError('Could not list the staged files with git\n\t=>%s\n' % stderr.strip())
+
+        static_alter_dir = os.path.join(os.path.abspath(self.config['static_alter_dir']), '')
+        refs = set()
+        for filename in stdout.splitlines():
+            if not filename.endswith('.sql'):
+                continue
+            if os.path.abspath(os.path.join(Constants.ALTER_DIR, filename)).startswith(static_alter_dir):
+                continue
+            match = re.match(r'^(\d+)', os.path.basename(filename))
+            if match is None:
+                sys.stderr.write('Skipping invalid filename: %s\n' % os.path.basename(filename))
+                continue
+            refs.add(match.group(1))
+        return refs
+
+    def sync_static_alter_dir(self, chain, options):
+        """
+        Bring 'static_alter_dir' in line with the chain. The static up and
+        down files of an alter are only written if its source file, or what
+        goes into the static file besides it (options and revision query),
+        changed since the last sync, as recorded in the manifest. Static files
+        that a previous sync wrote for alters no longer in the chain are
+        removed.
+
+        Returns a 2-tuple of the lists of static files written and removed
+        """
+        static_alter_dir = self.config['static_alter_dir']
+        manifest = StaticManifest(os.path.join(Constants.ALTER_DIR,
+                                               self.config.get('static_manifest', self.MANIFEST_FILENAME)))
+        written = []
+        removed = []
+        sources = set()
+        static_files = set(os.listdir(static_alter_dir))
+        up_options = copy.copy(options)
+        up_options.down_alter = False
+        down_options = copy.copy(options)
+        down_options.down_alter = True
+        try:
+            for node in chain.nodes:
+                for (filename, node_options) in ((node.filename, up_options),
+                                                 (node.down_filename(), down_options)):
+                    sources.add(filename)
+                    if self.__sync_static_file(node, filename, node_options, manifest,
+                                               filename in static_files):
+                        written.append(os.path.join(static_alter_dir, filename))
+                        print written[-1]
+
+            # only files written by a previous sync are removed, others in the
+            # directory (hand-written or unrelated) are left alone
+            for filename in sorted(set(manifest.filenames()) - sources):
+                static_filename = os.path.join(static_alter_dir, filename)
+                if os.path.exists(static_filename):
+                    os.remove(static_filename)
+                    removed.append(static_filename)
+                    sys.stderr.write('Removed %s\n' % static_filename)
+                manifest.remove(filename)
+        finally:
+            manifest.save()
+
+        return written, removed
+
+    def __sync_static_file(self, node, filename, options, manifest, exists):
+        """
+        Write the static file for the given alter (and direction) if it is out
+        of date or doesn't exist, recording it in the manifest. Returns True if
+        it was written.
+        """
+        source = os.path.join(Constants.ALTER_DIR, filename)
+        try:
+            stat = os.stat(source)
+        except OSError, ex:
+            raise ReadError("could not read file '%s'.\n\t=>%s\n" % (source, ex))
+        fingerprint = hashlib.sha1(repr((options.gen_sql, self._gen_rev_sql(node, options)))).hexdigest()
+
+        entry = manifest.get(filename)
+        up_to_date = exists and entry is not None and entry['fingerprint'] == fingerprint
+        if up_to_date and entry['stat'] == manifest.stat_key(stat):
+            return False
+
+        digest = self.__hash_file(source)
+        if up_to_date and entry['hash'] == digest:
+            manifest.put(filename, stat, digest, fingerprint)
+            return False
+
+        self._write_static_file((node, options))
+        manifest.put(filename, stat, digest, fingerprint)
+        return True
+
+    def __hash_file(self, filename):
+        digest = hashlib.sha1()
+        sql_file = open(filename)
+        try:
+            for block in iter(lambda: sql_file.read(self.BLOCK_SIZE), ''):
+                digest.update(block)
+        finally:
+            sql_file.close()
+        return digest.hexdigest()
+
+    def gen_sql_for_reflist(self, ref_nodes, options):
+        """
+        Given a list of ref nodes, generate the SQL for all of them. The SQL is
+        yielded piece by piece as it is read (see _gen_sql_for_ref), so memory
+        use doesn't grow with the size or number of alters. Trailing whitespace
+        is held back so that the output ends in a single newline.
+        """
         # If only one alter is being processed, there is no reason to add newlines.
         add_newlines = len(ref_nodes) > 1
+        trailing = ''
         for node in ref_nodes:
-            sql += self._gen_sql_for_ref(node, options, add_newlines)
-
-        sql = sql.rstrip() + "\n"
-        return sql
+            for chunk in self._gen_sql_for_ref(node, options, add_newlines):
+                content = chunk.rstrip()
+                if content:
+                    yield trailing + content
+                    trailing = chunk[len(content):]
+                else:
+                    trailing += chunk
+        yield "\n"
 
     def _gen_sql_for_ref(self, node, options, add_newlines):
         """
-        Gen sql given a node(ref) and the command-line-options,
+        Gen sql given a node(ref) and the command-line-options, yielding the
+        alter file in blocks followed by the revision query
         """
-        sql = ''
         if options.gen_sql:
-            try:
-                sql_file = None
-                if options.down_alter:
-                    sql_file = open(os.path.join(Constants.ALTER_DIR, node.down_filename()))
-                else:
-                    sql_file = open(os.path.join(Constants.ALTER_DIR, node.filename))
-                sql = sql_file.read()
-
-            except OSError, ex:
-                if 'sql_file' in locals():
-                    sql_file.close()
-                raise ReadError("could not file '%s'.\n\t=>%s\n" % (os.path.join(Constants.ALTER_DIR, node.filename), ex))
-
-        if options.include_rev_query or options.gen_revision:
             if options.down_alter:
-                rev_query = self.db.get_remove_commit_query(node.id)
+                filename = os.path.join(Constants.ALTER_DIR, node.down_filename())
             else:
-                rev_query = self.db.get_append_commit_query(node.id)
+                filename = os.path.join(Constants.ALTER_DIR, node.filename)
+            try:
+                sql_file = open(filename)
+            except (IOError, OSError), ex:
+                raise ReadError("could not read file '%s'.\n\t=>%s\n" % (filename, ex))
+            try:
+                for block in iter(lambda: sql_file.read(self.BLOCK_SIZE), ''):
+                    yield block
+            finally:
+                sql_file.close()
 
-            if options.include_rev_query:
-                sql += '\n\n-- start rev query\n%s;\n-- end rev query\n' % rev_query.encode('utf-8')
-            else:
-                sql += (rev_query + ';')
+        rev_sql = self._gen_rev_sql(node, options)
+        if rev_sql:
+            yield rev_sql
 
         if add_newlines:
-            sql += "\n\n"
-        return sql
+            yield "\n\n"
+
+    def _gen_rev_sql(self, node, options):
+        """
+        Return the revision query that follows the SQL of the given node
+        (empty if none is to be generated)
+        """
+        if not (options.include_rev_query or options.gen_revision):
+            return ''
+
+        if options.down_alter:
+            rev_query = self.db.get_remove_commit_query(node.id)
+        else:
+            rev_query = self.db.get_append_commit_query(node.id)
+
+        if options.include_rev_query:
+            return '\n\n-- start rev query\n%s;\n-- end rev query\n' % rev_query.encode('utf-8')
+        return rev_query + ';'
@@ -1,9 +1,12 @@
 # stdlib imports
+from itertools import islice
 from optparse import OptionParser
+import json
 import sys
 
 # local imports
 from command import Command
+from errors import MissingRefError, OptionsError
 from util import ChainUtil
 
 class ListCommand(Command):
@@ -16,53 +19,93 @@ class ListCommand(Command):
         parser.add_option('-r', '--reverse',
                           action='store_true', dest='listReverse', default=False,
                           help="List the contents of current alter chain in reverse order")
+        parser.add_option('--limit',
+                          action='store', type='int', dest='limit', default=None,
+                          help='List at most N alters')
+        parser.add_option('--offset',
+                          action='store', type='int', dest='offset', default=0,
+                          help='Skip the first N alters (in the order they are listed)')
+        parser.add_option('--since',
+                          action='store', dest='since', default=None,
+                          help='Only list the alters that come after the given ref in the chain')
+        parser.add_option('--format',
+                          action='store', type='choice', choices=['text', 'json-lines'],
+                          dest='format', default='text',
+                          help="Output format: 'text' (default) or 'json-lines' (one JSON object per alter)")
 
+        self.add_jobs_option(parser)
+        parser.add_option('--parallel',
+                          action='store', type='int', dest='parallel', default=None,
+                          help="With a 'fleet' config, number of targets to run against at once (default 1)")
         self.parser = parser
 
     def run(self):
         """
-        Print the current build chain in the console.
+        Print the current build chain in the console, one alter per line as
+        the chain is walked.
 
         Return the list of node IDs, which is used for testing.
         """
         # TODO: add a verbose mode, which shows alters as having been run or not
 
         (options, _) = self.parser.parse_args()
+        if options.limit is not None and options.limit < 0:
+            raise OptionsError('--limit must not be negative', self.parser.format_help())
+        if options.offset < 0:
+            raise OptionsError('--offset must not be negative', self.parser.format_help())
 
-        list_reverse = options.listReverse
-
-        list_tail = ChainUtil.build_chain()
-
-        self.__set_is_applied_flag(list_tail)
+        list_tail = ChainUtil.build_chain(jobs=options.jobs)
 
         result = []
 
         if list_tail is None:
-            sys.stdout.write("No alters found\n")
-        else:
-            normal_str = []
-            temp_node = list_tail
-            while temp_node is not None:
-                result.append(temp_node.id)
-                normal_str.append(temp_node.__str__(False))
-                temp_node = temp_node.backref
-            if not list_reverse:
-                normal_str.reverse()
-                result.reverse()
-            sys.stdout.write("\n".join(normal_str) + "\n")
+            if options.format == 'text':
+                sys.stdout.write("No alters found\n")
+            return result
+
+        # an unknown ref fails before anything is listed
+        if options.since is not None and options.since not in (node.id for node in self.__walk_back(list_tail)):
+            raise MissingRefError('revision (%s) not found in the chain' % options.since)
+
+        applied_alters = self.db.get_applied_alters()
+        for node in self.__select(list_tail, options):
+            node.is_applied = node.id in applied_alters
+            if options.format == 'json-lines':
+                line = json.dumps({
+                    'id': node.id,
+                    'filename': node.filename,
+                    'backref': node.backref.id if node.backref is not None else None,
+                    'applied': node.is_applied})
+            else:
+                line = node.__str__(False)
+            sys.stdout.write(line + "\n")
+            result.append(node.id)
 
         return result
 
-    def __set_is_applied_flag(self, chain):
+    def __select(self, tail, options):
         """
-        Sets a flag for each node in the chain whether it has been applied to the
-        database or not.
+        Yield the nodes to list, in the order they are listed. The chain is
+        walked from its tail (the newest alter), so a listing in reverse order
+        stops walking once enough alters are listed, and --since stops the walk
+        at the given ref in either order.
         """
-        applied_alters = self.db.get_applied_alters()
-        tail = chain
-        while tail is not None:
-            if tail.id in applied_alters:
-                tail.is_applied = True
-            else:
-                tail.is_applied = False
-            tail = tail.backref
+        nodes = self.__walk_back(tail, options.since)
+        if not options.listReverse:
+            nodes = reversed(list(nodes))
+        stop = None
+        if options.limit is not None:
+            stop = options.offset + options.limit
+        return islice(nodes, options.offset, stop)
+
+    def __walk_back(self, tail, since=None):
+        """
+        Yield the nodes of the chain from the tail back to (excluding) the
+        given ref, or to the start of the chain
+        """
+        node = tail
+        while node is not None:
+            if node.id == since:
+                return
+            yield node
+            node = node.backref
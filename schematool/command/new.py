@@ -8,6 +8,7 @@ from time import time
 from command import Command
 from constants import Constants
 from errors import WriteError
+from node import SimpleNode
 from util import ChainUtil
 
 class NewCommand(Command):
@@ -18,6 +19,7 @@ class NewCommand(Command):
                           dest="filename", action="store",
                           help="The name of the new file")
 
+        self.add_jobs_option(parser)
         self.parser = parser
 
     def run(self):
@@ -36,7 +38,7 @@ class NewCommand(Command):
         timestamp = str(round(time() * 10)).replace('.', '')
         filename = timestamp + '-' + (options.filename or '_').replace('.sql', '')
 
-        alter_list_tail = ChainUtil.build_chain()
+        alter_list_tail = ChainUtil.get_tail(jobs=options.jobs)
 
         if alter_list_tail is not None:
             sys.stdout.write("Parent file:  %s\n" % alter_list_tail.filename)
@@ -65,4 +67,6 @@ class NewCommand(Command):
             raise WriteError("Could not write file '%s'\n\t=>%s" % (os.path.join(Constants.ALTER_DIR, up_filename), ex.message))
         sys.stdout.write("Created file: %s\n" % down_filename)
 
+        ChainUtil.set_tail(SimpleNode(id=timestamp, filename=up_filename))
+
         return timestamp
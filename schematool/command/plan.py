@@ -0,0 +1,103 @@
+# stdlib imports
+from optparse import OptionParser
+import json
+import os
+import sys
+
+# local imports
+from command import Command
+from check import CheckCommand
+from down import DownCommand
+from errors import OptionsError
+from up import UpCommand
+from util import ChainUtil, PlanUtil
+
+class PlanCommand(Command):
+    def init_parser(self):
+        usage = "schema plan [options] [ref]" \
+                "\n       schema plan --down [options] [all|base|ref]" \
+                "\n\n" \
+                "Show what 'up' (or 'down') would run, as JSON, without running anything." \
+                "\n\n" \
+                "Arguments" \
+                "\n  ref               Plan all alters up to, and including, the ref given" \
+                "\n  all|base|ref      With --down, see 'schema down -h'"
+        parser = OptionParser(usage=usage)
+        parser.add_option('-d', '--down',
+                          action='store_true', dest='down', default=False,
+                          help='Plan a down instead of an up')
+        parser.add_option('-n', '--number',
+                          action='store', dest='N',
+                          help='Plan N number of alters from current state - overrides arguments')
+        parser.add_option('-f', '--force',
+                          action='store_true', dest='force', default=False,
+                          help='Plan as if run with the -f option')
+        parser.add_option('-u', '--no-undo',
+                          action='store_false', dest='undo', default=True,
+                          help='Plan as if up is run with the -u option')
+        self.add_jobs_option(parser)
+        parser.add_option('--parallel',
+                          action='store', type='int', dest='parallel', default=None,
+                          help="With a 'fleet' config, number of targets to run against at once (default 1)")
+        self.parser = parser
+
+    def run(self):
+        """
+        Reconcile the history of the DB with the alter chain the same way up
+        (or down) does, and print the resulting plan as a JSON object:
+            in_sync: whether there is nothing to do
+            undo: alters that would be run down, in order
+            apply: alters that would be run up, in order
+            missing: history entries without an alter that would be dropped
+            warnings: messages up/down would show
+        Each alter is given with its id, the file that would be run, its size
+        in bytes and whether it runs in the configured env.
+
+        Returns the plan as a dictionary, which is used for testing.
+        """
+        (options, args) = self.parser.parse_args()
+
+        CheckCommand(self.context).run(inline=True, jobs=options.jobs)
+
+        history = self.db.get_commit_history(descending=options.down)
+        tail = ChainUtil.build_chain(jobs=options.jobs)
+        should_run = UpCommand(self.context).should_run
+        if options.down:
+            if len(args) == 0 and options.N is None:
+                raise OptionsError("must specify either argument or number of down-alters to plan", self.parser.format_help())
+            run_type, target_rev = DownCommand(self.context).parse_args(args)
+            plan = PlanUtil.plan_down(tail, history,
+                                      run_type=run_type,
+                                      target=target_rev,
+                                      number=options.N,
+                                      force=options.force)
+        else:
+            plan = PlanUtil.plan_up(tail, history, should_run,
+                                    target=args[0] if len(args) > 0 else None,
+                                    number=options.N,
+                                    undo=options.undo,
+                                    force=options.force)
+
+        result = {
+            'in_sync': not (plan.undo or plan.apply or plan.missing),
+            'undo': [self.__entry(alter, 'down', should_run) for alter in plan.undo],
+            'apply': [self.__entry(alter, 'up', should_run) for alter in plan.apply],
+            'missing': plan.missing,
+            'warnings': [w.strip() for w in plan.warnings]
+        }
+        sys.stdout.write(json.dumps(result, indent=2, sort_keys=True) + "\n")
+
+        return result
+
+    def __entry(self, alter, direction, should_run):
+        filename = alter.abs_filename(direction=direction)
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            size = None
+        return {
+            'id': alter.id,
+            'filename': os.path.basename(filename),
+            'size': size,
+            'should_run': should_run(alter)
+        }
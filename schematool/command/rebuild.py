@@ -17,6 +17,7 @@ class RebuildCommand(Command):
         parser.add_option('-v', '--verbose',
                           action='store_true', dest='verbose', default=False,
                           help='Output verbose error-messages when used with -f option if errors are encountered')
+        self.add_jobs_option(parser)
         self.parser = parser
 
     def run(self):
@@ -28,6 +29,8 @@ class RebuildCommand(Command):
             sys.argv.append('--force')
         if options.verbose:
             sys.argv.append('--verbose')
+        if options.jobs:
+            sys.argv.append('--jobs=%d' % options.jobs)
         sys.argv.append('all')
         DownCommand(self.context).run()
 
@@ -37,4 +40,6 @@ class RebuildCommand(Command):
             sys.argv.append('--force')
         if options.verbose:
             sys.argv.append('--verbose')
+        if options.jobs:
+            sys.argv.append('--jobs=%d' % options.jobs)
         UpCommand(self.context).run()
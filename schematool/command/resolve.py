@@ -22,6 +22,7 @@ class ResolveCommand(Command):
         self.file = None
         self.ref = None
         self.type = None
+        self.jobs = None
 
     def init_parser(self):
         usage = "schema resolve [ref|filename]" \
@@ -32,6 +33,7 @@ class ResolveCommand(Command):
         # parser.add_option('-f', '--force',
         #                   action='store_true', dest='force', default=False,
         #                   help='Ignore warnings and force the resolution')
+        self.add_jobs_option(parser)
         self.parser = parser
 
     def run(self):
@@ -54,7 +56,8 @@ class ResolveCommand(Command):
             given the force option, can undo the commit before resolving (should issue
             message about what has happened).
         """
-        (_, args) = self.parser.parse_args()
+        (options, args) = self.parser.parse_args()
+        self.jobs = options.jobs
 
         if len(args) == 0:
             raise ArgsError("You must provide a filename or reference", self.parser.format_help())
@@ -106,10 +109,10 @@ class ResolveCommand(Command):
                     my_file.close()
                 sys.stderr.write("Error reading file '%s'\n\t=>%s\n" % (self.file, ex.message))
 
-            if not MetaDataUtil.parse_direction(head) == 'up':
+            (direction, meta_data) = MetaDataUtil.parse_head(head)
+            if not direction == 'up':
                 sys.stderr.write("File can only be an up-alter: '%s'" % self.file)
 
-            meta_data = MetaDataUtil.parse_meta(head)
             if 'ref' in meta_data:
                 self.ref = meta_data['ref']
 
@@ -148,7 +151,7 @@ class ResolveCommand(Command):
         """
         if not self.nodes:
             files = ChainUtil.get_alter_files()
-            self.nodes = ChainUtil.build_soft_chain(files)
+            self.nodes = ChainUtil.build_soft_chain(files, self.jobs)
 
         return self.nodes
 
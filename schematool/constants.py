@@ -11,12 +11,14 @@ class Constants(object):
         {'command': 'list',     'handler': 'ListCommand'},
         {'command': 'up',       'handler': 'UpCommand'},
         {'command': 'down',     'handler': 'DownCommand'},
+        {'command': 'plan',     'handler': 'PlanCommand'},
         {'command': 'rebuild',  'handler': 'RebuildCommand'},
         {'command': 'gen-ref',  'handler': 'GenRefCommand'},
         {'command': 'resolve',  'handler': 'ResolveCommand'},
         {'command': 'init',     'handler': 'InitCommand'},
         {'command': 'gen-sql',  'handler': 'GenSqlCommand'}
     ]
+    FLEET_COMMANDS = ['up', 'down', 'list', 'plan']
     FILENAME_STANDARD = re.compile('^\d{12}-.+-(up|down)\.sql$')
     ENV_NAME_STANDARD = re.compile('^([a-zA-Z0-9_-]+)$')
     ISSUE_URL = "http://github.com/appnexus/schema-tool/issues"
@@ -3,3 +3,4 @@ from _memory import MemoryDb
 from _mysql import MySQLDb
 from _pg import PostgresDb
 from _vertica import VerticaDb
+from pool import ConnectionPool
@@ -12,6 +12,7 @@ except ImportError:
 
 # local imports
 from db import Db
+from pool import ConnectionPool
 from errors import DbError, InitError
 
 class HiveDb(Db):
@@ -19,39 +20,34 @@ class HiveDb(Db):
     DUMMY_ALTER_REF = '000000000000'
     HIVE_INIT_FILENAME = 'schema_tool_hive_init.tsv'
 
-    @classmethod
-    def new(cls, config):
-        super(HiveDb, cls).new(config)
-        if 'revision_db_name' in cls.config and 'history_table_name' in cls.config:
-            cls.db_name = '`%s`' % cls.config['revision_db_name']
-            cls.history_table_name = cls.config['history_table_name']
-            cls.full_table_name = '`%s`.`%s`' % (cls.config['revision_db_name'],
-                                                 cls.config['history_table_name'])
+    def __init__(self, config):
+        super(HiveDb, self).__init__(config)
+        if 'revision_db_name' in self.config and 'history_table_name' in self.config:
+            self.db_name = '`%s`' % self.config['revision_db_name']
+            self.history_table_name = self.config['history_table_name']
+            self.full_table_name = '`%s`.`%s`' % (self.config['revision_db_name'],
+                                                  self.config['history_table_name'])
         else:
             raise DbError('No history schema found in config file. Please add values for the '
                           'following keys: revision_db_name, history_table_name\n')
 
-        return cls
-
-    @classmethod
-    def init_conn(cls):
+    def init_conn(self):
         try:
             hive
         except NameError:
             raise DbError('Hive client module not found/loaded. Please make sure all dependencies are installed\n')
 
-        cls.conn = cls.conn()
-        cls.cursor = cls.conn.cursor()
+        self.connection = ConnectionPool.acquire(self.pool_key(), self.conn, self.check_conn)
+        self.cursor = self.connection.cursor()
 
-        cls.conn_initialized = True
-        return cls
+        self.conn_initialized = True
+        return self
 
-    @classmethod
-    def execute(cls, query, data=None):
-        if not cls.conn_initialized:
-            cls.init_conn()
+    def execute(self, query, data=None):
+        if not self.conn_initialized:
+            self.init_conn()
 
-        cursor = cls.cursor
+        cursor = self.cursor
         results = []
         try:
             if data:
@@ -64,12 +60,10 @@ class HiveDb(Db):
         except Pyhs2Exception, e:
             raise DbError('Could not query DB. Exception:\n%s\n\nQuery:%s' % (e, query))
 
-    @classmethod
-    def drop_revision(cls):
-        return cls.execute('DROP DATABASE IF EXISTS %s' % cls.config['revision_db_name'])
+    def drop_revision(self):
+        return self.execute('DROP DATABASE IF EXISTS %s' % self.config['revision_db_name'])
 
-    @classmethod
-    def create_revision(cls):
+    def create_revision(self):
         # Executing 'CREATE DATABASE IF NOT EXISTS' fails if the user does not
         # have database creation privileges, even if the database already exists.
         # The correct action is to break this method into two parts: checking
@@ -77,33 +71,34 @@ class HiveDb(Db):
         #
         # The 'IF NOT EXISTS' flag is still used in case the database is
         # created after the existence check but before the CREATE statement.
-        check = 'SHOW DATABASES LIKE "%s"' % cls.config['revision_db_name']
-        results = cls.execute(check)
+        check = 'SHOW DATABASES LIKE "%s"' % self.config['revision_db_name']
+        results = self.execute(check)
         if len(results):
             return
         else:
-            return cls.execute('CREATE DATABASE IF NOT EXISTS %s' % cls.config['revision_db_name'])
+            return self.execute('CREATE DATABASE IF NOT EXISTS %s' % self.config['revision_db_name'])
+
+    def fetch_commit_history(self, descending=False):
+        # Omit the placeholder row
+        return self.execute('SELECT id, alter_hash, ran_on FROM %s WHERE alter_hash != \'%s\' ORDER BY id%s' %
+            (self.full_table_name, self.DUMMY_ALTER_REF, ' DESC' if descending else ''))
 
-    @classmethod
-    def get_commit_history(cls):
+    def history_probe(self):
         # Omit the placeholder row
-        return cls.execute('SELECT id, alter_hash, ran_on FROM %s WHERE alter_hash != \'%s\'' %
-            (cls.full_table_name, cls.DUMMY_ALTER_REF))
+        results = self.execute('SELECT MAX(id), COUNT(*), MAX(ran_on) FROM %s WHERE alter_hash != \'%s\'' %
+            (self.full_table_name, self.DUMMY_ALTER_REF))
+        return list(results[0])
 
-    @classmethod
-    def get_applied_alters(cls):
+    def fetch_applied_alters(self):
         # Omit the placeholder row
-        results = cls.execute('SELECT alter_hash FROM %s WHERE alter_hash != \'%s\'' %
-            (cls.full_table_name, cls.DUMMY_ALTER_REF))
-        alters_hashes = [result[0] for result in results]
-        return alters_hashes
+        results = self.execute('SELECT alter_hash FROM %s WHERE alter_hash != \'%s\'' %
+            (self.full_table_name, self.DUMMY_ALTER_REF))
+        return set(result[0] for result in results)
 
-    @classmethod
-    def append_commit(cls, ref):
-        return cls.execute(cls.get_append_commit_query(ref))
+    def append_commit(self, ref):
+        return self.execute(self.get_append_commit_query(ref))
 
-    @classmethod
-    def get_append_commit_query(cls, ref):
+    def get_append_commit_query(self, ref):
         # Use a monotonically increasing value for the id field, since Hive does not have an
         # auto-increment mechanism
         id_value = int(time())
@@ -111,29 +106,26 @@ class HiveDb(Db):
         return ("""INSERT INTO TABLE %s
                    SELECT %s AS id, '%s' AS alter_hash, '%s' AS ran_on FROM %s
                    WHERE alter_hash = '%s' LIMIT 1""" %
-            (cls.full_table_name, id_value, ref, ran_on, cls.full_table_name, cls.DUMMY_ALTER_REF))
+            (self.full_table_name, id_value, ref, ran_on, self.full_table_name, self.DUMMY_ALTER_REF))
 
-    @classmethod
-    def remove_commit(cls, ref):
-        return cls.execute(cls.get_remove_commit_query(ref))
+    def remove_commit(self, ref):
+        return self.execute(self.get_remove_commit_query(ref))
 
-    @classmethod
-    def get_remove_commit_query(cls, ref):
+    def get_remove_commit_query(self, ref):
         return ("""INSERT OVERWRITE TABLE %s SELECT * FROM %s
-                   WHERE alter_hash != '%s'""" % (cls.full_table_name, cls.full_table_name, ref))
+                   WHERE alter_hash != '%s'""" % (self.full_table_name, self.full_table_name, ref))
 
-    @classmethod
-    def create_history(cls):
-        create_table_result = cls.execute("""CREATE TABLE IF NOT EXISTS %s (
+    def create_history(self):
+        create_table_result = self.execute("""CREATE TABLE IF NOT EXISTS %s (
                                                 id int,
                                                 alter_hash string,
                                                 ran_on timestamp
                                             ) ROW FORMAT DELIMITED FIELDS TERMINATED BY '\t'
-                                            STORED AS TEXTFILE""" % cls.full_table_name)
+                                            STORED AS TEXTFILE""" % self.full_table_name)
 
         # Check whether table has been bootstrapped with the intial placeholder entry
-        results = cls.execute('SELECT * FROM %s WHERE alter_hash = \'%s\'' %
-            (cls.full_table_name, cls.DUMMY_ALTER_REF))
+        results = self.execute('SELECT * FROM %s WHERE alter_hash = \'%s\'' %
+            (self.full_table_name, self.DUMMY_ALTER_REF))
 
         if not results:
             # Create a tab-separated file that will be used to seed the history table, and attempt
@@ -144,10 +136,10 @@ class HiveDb(Db):
             # "pivot" row into the history table so that we can simulate standard insert and delete
             # operations using 'INSERT INTO ... SELECT' syntax. This is a bit roundabout, but seems
             # to be most compatible with our particular Hive/Hadoop installation.
-            init_file_path = os.path.join(tempfile.gettempdir(), cls.HIVE_INIT_FILENAME)
+            init_file_path = os.path.join(tempfile.gettempdir(), self.HIVE_INIT_FILENAME)
             with open(init_file_path, 'w') as f:
                 ran_on = datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')
-                f.write('0\t%s\t%s\n' % (cls.DUMMY_ALTER_REF, ran_on))
+                f.write('0\t%s\t%s\n' % (self.DUMMY_ALTER_REF, ran_on))
             os.chmod(init_file_path, 0666)
 
             try:
@@ -161,8 +153,8 @@ class HiveDb(Db):
                 # There does not seem to be a better way to bootstrap the history table
                 # without direct access to the host on which the Hive server is running or manipulating
                 # the table via HDFS, which seems outside the scope of this schema tool.
-                cls.execute("LOAD DATA LOCAL INPATH '%s' OVERWRITE INTO TABLE %s" %
-                    (init_file_path, cls.full_table_name))
+                self.execute("LOAD DATA LOCAL INPATH '%s' OVERWRITE INTO TABLE %s" %
+                    (init_file_path, self.full_table_name))
             except DbError, e:
                 raise InitError('Unable to initialize history table. If you are pointing to a Hive '
                     'server running on a remote host, please copy the file \'%s\' to the same path '
@@ -171,14 +163,26 @@ class HiveDb(Db):
 
         return create_table_result
 
-    @classmethod
-    def conn(cls):
+    def check_conn(self, conn):
+        # a thrift connection only notices the server is gone when used
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetch()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def conn(self):
         """
         return the hive connection handle to the configured server
         """
-        config = cls.config
+        config = self.config
         try:
-            connection = hive.connect(host=config['host'], port=config.get('port', cls.DEFAULT_PORT),
+            connection = hive.connect(host=config['host'], port=config.get('port', self.DEFAULT_PORT),
                                       authMechanism='NOSASL', user=config['username'],
                                       password=config['password'])
         except Exception, e:
@@ -188,20 +192,19 @@ class HiveDb(Db):
 
         return connection
 
-    @classmethod
-    def run_file_cmd(cls, filename):
+    def run_file_cmd(self, filename):
         """
         return a 3-tuple of strings containing:
             the command to run (list)
             environment variables to be passed to command (dictionary or None)
             data to be piped into stdin (file-like object or None)
         """
-        port = cls.config.get('port', cls.DEFAULT_PORT)
-        jdbc_url = 'jdbc:hive2://%s:%s/default;auth=noSasl' % (cls.config['host'], port)
+        port = self.config.get('port', self.DEFAULT_PORT)
+        jdbc_url = 'jdbc:hive2://%s:%s/default;auth=noSasl' % (self.config['host'], port)
 
         # Beeline is the recommended command-line client for HiveServer2
         cmd = ['beeline', '-u', jdbc_url,
-               '-n', cls.config['username'],
-               '-p', cls.config['password'],
+               '-n', self.config['username'],
+               '-p', self.config['password'],
                '-f', filename]
         return cmd, None, None
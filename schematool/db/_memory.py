@@ -2,68 +2,82 @@
 import copy
 
 from db import Db
+from errors import DbError
 
 class MemoryDb(Db):
-    @classmethod
-    def new(cls, config):
-        super(MemoryDb, cls).new(config)
+    """
+    In-memory stand-in for a database, used for testing. The history and the
+    statements run are kept on the class, playing the part of a database
+    server that all instances (connections) share. Creating a new instance
+    starts over with an empty one.
+    """
+    SQL_DIALECT = 'mysql'
+
+    data = []
+    id   = 0
+    statements = []
+
+    def __init__(self, config):
+        super(MemoryDb, self).__init__(config)
+        self.auto_throw_error = True
 
+    @classmethod
+    def reset(cls):
+        """
+        Forget the history and statements, which all instances share
+        """
         cls.data = []
         cls.id   = 0
-        cls.auto_throw_error = True
-
-        return cls
+        cls.statements = []
 
-    @classmethod
-    def init_conn(cls):
+    def init_conn(self):
         pass
 
-    @classmethod
-    def drop_revision(cls):
-        cls.data = []
+    def run_statement(self, statement):
+        # Used for testing to simulate an error in the running of an alter
+        if self.auto_throw_error and 'error' in statement:
+            raise DbError('Simulated error running statement: %s' % statement)
+        MemoryDb.statements.append(statement)
 
-    @classmethod
-    def create_revision(cls):
+    def drop_revision(self):
+        MemoryDb.data = []
+
+    def create_revision(self):
         pass
 
-    @classmethod
-    def get_commit_history(cls):
-        return copy.copy(cls.data)
+    def fetch_commit_history(self, descending=False):
+        return iter(sorted(copy.copy(MemoryDb.data), key=lambda d: d[0], reverse=descending))
 
-    @classmethod
-    def get_applied_alters(cls):
-        return [d[1] for d in cls.data]
+    def fetch_applied_alters(self):
+        return set(d[1] for d in MemoryDb.data)
 
-    @classmethod
-    def append_commit(cls, ref):
-        cls.id += 1
-        cls.data.append([cls.id, ref, None])
+    def history_probe(self):
+        return [max([d[0] for d in MemoryDb.data] or [None]), len(MemoryDb.data),
+                max([d[2] for d in MemoryDb.data] or [None])]
 
-    @classmethod
-    def get_append_commit_query(cls, _):
+    def append_commit(self, ref):
+        MemoryDb.id += 1
+        MemoryDb.data.append([MemoryDb.id, ref, None])
+
+    def get_append_commit_query(self, _):
         return "n/a for memory-db"
 
-    @classmethod
-    def remove_commit(cls, ref):
-        to_remove = [d for d in cls.data if d[1] == ref]
+    def remove_commit(self, ref):
+        to_remove = [d for d in MemoryDb.data if d[1] == ref]
         if len(to_remove) > 0:
-            cls.data.remove(to_remove[0])
+            MemoryDb.data.remove(to_remove[0])
         return True
 
-    @classmethod
-    def get_remove_commit_query(cls, _):
+    def get_remove_commit_query(self, _):
         return "n/a for memory-db"
 
-    @classmethod
-    def create_history(cls):
+    def create_history(self):
         return True
 
-    @classmethod
-    def conn(cls):
-        return cls
+    def conn(self):
+        return self
 
-    @classmethod
-    def run_file_cmd(cls, filename):
+    def run_file_cmd(self, filename):
         """
         return a 3-tuple of strings containing:
             the command to run (list)
@@ -72,8 +86,7 @@ class MemoryDb(Db):
         """
         return ['/bin/true'], None, None
 
-    @classmethod
-    def run_file_cmd_with_error(cls, filename):
+    def run_file_cmd_with_error(self, filename):
         """
         return a 3-tuple of strings containing:
             the command to run (list)
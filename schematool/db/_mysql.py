@@ -13,45 +13,41 @@ except ImportError, e:
 
 # local imports
 from db import Db
+from pool import ConnectionPool
 from errors import DbError
 
 class MySQLDb(Db):
-    @classmethod
-    def new(cls, config):
-        super(MySQLDb, cls).new(config)
-
-        if 'revision_db_name' in cls.config and 'history_table_name' in cls.config:
-            cls.db_name = '`%s`' % cls.config['revision_db_name']
-            cls.history_table_name = cls.config['history_table_name']
-            cls.full_table_name = '`%s`.`%s`' % (cls.config['revision_db_name'],
-                                                 cls.config['history_table_name'])
+    SQL_DIALECT = 'mysql'
+
+    def __init__(self, config):
+        super(MySQLDb, self).__init__(config)
+
+        if 'revision_db_name' in self.config and 'history_table_name' in self.config:
+            self.db_name = '`%s`' % self.config['revision_db_name']
+            self.history_table_name = self.config['history_table_name']
+            self.full_table_name = '`%s`.`%s`' % (self.config['revision_db_name'],
+                                                  self.config['history_table_name'])
         else:
             raise DbError('No history schema found in config file. Please add values for the '
                           'following keys: revision_db_name, history_table_name\n')
 
-
-        return cls
-
-
-    @classmethod
-    def init_conn(cls):
+    def init_conn(self):
         try:
             mysql
         except NameError:
             raise DbError('MySQL module not found/loaded. Please make sure all dependencies are installed\n')
 
-        cls.conn = cls.conn()
-        cls.cursor = cls.conn.cursor()
+        self.connection = ConnectionPool.acquire(self.pool_key(), self.conn, self.check_conn)
+        self.cursor = self.connection.cursor()
 
-        cls.conn_initialized = True
-        return cls
+        self.conn_initialized = True
+        return self
 
-    @classmethod
-    def execute(cls, query, data=None):
-        if not cls.conn_initialized:
-            cls.init_conn()
+    def execute(self, query, data=None):
+        if not self.conn_initialized:
+            self.init_conn()
         try:
-            cursor = cls.cursor
+            cursor = self.cursor
             if data is not None:
                 cursor.execute(query, data)
             else:
@@ -63,15 +59,26 @@ class MySQLDb(Db):
             res = cursor.fetchall()
         except mysql.connector.InterfaceError, e:
             res = None
-        cls.conn.commit()
+        self.connection.commit()
         return res
 
-    @classmethod
-    def drop_revision(cls):
-        return cls.execute('DROP DATABASE IF EXISTS %s' % cls.db_name)
+    def run_statement(self, statement):
+        if not self.conn_initialized:
+            self.init_conn()
+        try:
+            # cmd_query_iter also copes with statements returning several
+            # results (e.g. CALL); any rows are read and thrown away
+            for result in self.connection.cmd_query_iter(statement):
+                if 'columns' in result:
+                    self.connection.get_rows()
+        except mysql.connector.Error, e:
+            raise DbError('Could not run statement. Exception:\n%s\n\nStatement:%s' % (e, statement))
+        self.connection.commit()
 
-    @classmethod
-    def create_revision(cls):
+    def drop_revision(self):
+        return self.execute('DROP DATABASE IF EXISTS %s' % self.db_name)
+
+    def create_revision(self):
         # Executing 'CREATE DATABASE IF NOT EXISTS' fails if the user does not
         # have database creation privileges, even if the database already
         # exists.  The correct action is to break this method into two parts:
@@ -81,52 +88,93 @@ class MySQLDb(Db):
         # The 'IF NOT EXISTS' flag is still used in case the database is
         # created after the existence check but before the CREATE statement.
         check = "SELECT EXISTS(SELECT 1 FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = %s)"
-        result = cls.execute(check, [cls.config['revision_db_name']])
+        result = self.execute(check, [self.config['revision_db_name']])
         if result[0] == (1,):
             return
         else:
-            return cls.execute('CREATE DATABASE IF NOT EXISTS %s' % cls.db_name)
-
-    @classmethod
-    def get_commit_history(cls):
-        return cls.execute('SELECT id, alter_hash, ran_on FROM %s' % cls.full_table_name)
+            return self.execute('CREATE DATABASE IF NOT EXISTS %s' % self.db_name)
 
-    @classmethod
-    def append_commit(cls, ref):
-        return cls.execute('INSERT INTO %s (alter_hash) VALUES (%s)' % (cls.full_table_name, '%s'),
-                           [ref])
-
-    @classmethod
-    def get_append_commit_query(cls, ref):
-        return "INSERT INTO %s (alter_hash, ran_on) VALUES ('%s', NOW())" % (cls.full_table_name, ref)
-
-    @classmethod
-    def remove_commit(cls, ref):
-        return cls.execute('DELETE FROM %s WHERE alter_hash = %s' % (cls.full_table_name, '%s'),
-                           [ref])
-
-    @classmethod
-    def get_remove_commit_query(cls, ref):
-        return "DELETE FROM %s WHERE alter_hash = '%s'" % (cls.full_table_name, ref)
-
-    @classmethod
-    def create_history(cls):
-        return cls.execute("""CREATE TABLE IF NOT EXISTS %s (
+    def fetch_commit_history(self, descending=False):
+        """
+        Return an iterator over the history, ordered by id (newest first if
+        descending). Rows are read from an unbuffered cursor as they are
+        consumed rather than all at once.
+        """
+        query = 'SELECT id, alter_hash, ran_on FROM %s ORDER BY id%s' % (
+            self.full_table_name, ' DESC' if descending else '')
+        return self.__stream(query)
+
+    def __stream(self, query):
+        # the query only runs once iteration starts, so that an iterator that
+        # is dropped unused leaves no unread result on the connection
+        if not self.conn_initialized:
+            self.init_conn()
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute(query)
+        except mysql.connector.Error, e:
+            raise DbError('Could not query DB. Exception:\n%s\n\nQuery:%s' % (e, query))
+        try:
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            # the connection can't be used again until the whole result is read
+            while cursor.fetchmany(1000):
+                pass
+            cursor.close()
+            self.connection.commit()
+
+    def append_commit(self, ref):
+        return self.execute('INSERT INTO %s (alter_hash) VALUES (%s)' % (self.full_table_name, '%s'),
+                            [ref])
+
+    def append_commits(self, refs):
+        values = ', '.join(['(%s)'] * len(refs))
+        return self.execute('INSERT INTO %s (alter_hash) VALUES %s' % (self.full_table_name, values),
+                            list(refs))
+
+    def get_append_commit_query(self, ref):
+        return "INSERT INTO %s (alter_hash, ran_on) VALUES ('%s', NOW())" % (self.full_table_name, ref)
+
+    def remove_commit(self, ref):
+        return self.execute('DELETE FROM %s WHERE alter_hash = %s' % (self.full_table_name, '%s'),
+                            [ref])
+
+    def remove_commits(self, refs):
+        values = ', '.join(['%s'] * len(refs))
+        return self.execute('DELETE FROM %s WHERE alter_hash IN (%s)' % (self.full_table_name, values),
+                            list(refs))
+
+    def get_remove_commit_query(self, ref):
+        return "DELETE FROM %s WHERE alter_hash = '%s'" % (self.full_table_name, ref)
+
+    def create_history(self):
+        return self.execute("""CREATE TABLE IF NOT EXISTS %s (
         `id` int(11) unsigned not null primary key auto_increment,
         `alter_hash` varchar(100) not null,
         `ran_on` timestamp not null,
         constraint uq_%s__alter_hash unique (`alter_hash`)
         ) engine=InnoDB
-        """ % (cls.full_table_name, cls.history_table_name))
+        """ % (self.full_table_name, self.history_table_name))
+
+    def check_conn(self, conn):
+        try:
+            conn.ping(reconnect=True)
+        except mysql.connector.Error:
+            return False
+        return True
 
-    @classmethod
-    def conn(cls):
+    def conn(self):
         """
         return the mysql connection handle to the configured server
         """
-        config = cls.config
+        config = self.config
         try:
-            if cls.config.get('password'):
+            if self.config.get('password'):
                 conn = mysql.connector.Connect(user=config['username'],
                                                password=config['password'],
                                                host=config['host'],
@@ -153,20 +201,42 @@ class MySQLDb(Db):
 
         return conn
 
-    @classmethod
-    def run_file_cmd(cls, filename):
+    def client_cmd(self):
+        """
+        return a 2-tuple containing:
+            the command line client to run (list)
+            environment variables to be passed to command (dictionary or None)
+        """
+        cmd = ['mysql',
+               '-h', self.config['host'],
+               '-u', self.config['username']]
+        if self.config.get('password'):
+            cmd.append('-p%s' % self.config['password'])
+        if self.config.get('port'):
+            cmd.append('-P%s' % self.config['port'])
+        my_env = None
+        return cmd, my_env
+
+    def run_file_cmd(self, filename):
         """
         return a 3-tuple of strings containing:
             the command to run (list)
             environment variables to be passed to command (dictionary or None)
             data to be piped into stdin (file-like object or None)
         """
-        cmd = ['mysql',
-               '-h', cls.config['host'],
-               '-u', cls.config['username']]
-        if cls.config.get('password'):
-            cmd.append('-p%s' % cls.config['password'])
-        if cls.config.get('port'):
-            cmd.append('-P%s' % cls.config['port'])
-        my_env = None
+        cmd, my_env = self.client_cmd()
         return cmd, my_env, open(filename)
+
+    def session_cmd(self):
+        """
+        return a 3-tuple containing:
+            the command to run for a long-lived client session (list)
+            environment variables to be passed to command (dictionary or None)
+            the statement (a format string, given a token) used to echo a marker
+        """
+        cmd, my_env = self.client_cmd()
+        # flush the output after each statement so the marker is seen right away,
+        # and leave out column names so the marker is a line of its own
+        cmd.append('--unbuffered')
+        cmd.append('--skip-column-names')
+        return cmd, my_env, "SELECT '%s' AS schema_tool_marker;\n"
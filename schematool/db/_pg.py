@@ -9,44 +9,41 @@ except ImportError:
 
 # local imports
 from db import Db
+from pool import ConnectionPool
 from errors import DbError
 
 class PostgresDb(Db):
     DEFAULT_PORT=5432
+    SQL_DIALECT = 'postgres'
 
-    @classmethod
-    def new(cls, config):
-        super(PostgresDb, cls).new(config)
-        if 'revision_schema_name' in cls.config:
-            cls.history_table_name = cls.config['history_table_name']
-            cls.full_table_name = '"%s"."%s"' % (cls.config['revision_schema_name'],
-                                                 cls.config['history_table_name'])
+    def __init__(self, config):
+        super(PostgresDb, self).__init__(config)
+        if 'revision_schema_name' in self.config:
+            self.history_table_name = self.config['history_table_name']
+            self.full_table_name = '"%s"."%s"' % (self.config['revision_schema_name'],
+                                                  self.config['history_table_name'])
         else:
             raise DbError('No schema found in config file. Please add one with the key: '
                           'revision_schema_name')
+        self.alter_conn = None
 
-        return cls
-
-    @classmethod
-    def init_conn(cls):
+    def init_conn(self):
         try:
             psycopg2
         except NameError:
             raise DbError('Postgres module not found/loaded. Please make sure psycopg2 is installed\n')
 
-        cls.conn = cls.conn()
-        cls.cursor = cls.conn.cursor()
+        self.connection = ConnectionPool.acquire(self.pool_key(), self.conn, self.check_conn)
+        self.cursor = self.connection.cursor()
 
-        cls.conn_initialized = True
-        return cls
+        self.conn_initialized = True
+        return self
 
-    @classmethod
-    def execute(cls, query, data=None):
-        if not cls.conn_initialized:
-            cls.init_conn()
+    def execute(self, query, data=None):
+        if not self.conn_initialized:
+            self.init_conn()
         try:
-            cursor = cls.cursor
-            cursor.execute('SET search_path TO %s' % cls.config['schema_name'])
+            cursor = self.cursor
             if data:
                 cursor.execute(query, data)
             else:
@@ -71,18 +68,39 @@ class PostgresDb(Db):
                 except psycopg2.ProgrammingError, e:
                     if str(e) != 'no results to fetch':
                         raise psycopg2.ProgrammingError(e.message)
-            cls.conn.commit()
+            self.connection.commit()
             return results
         except Exception, e:
             raise DbError('Psycopg2 execution error: %s\n. Query: %s - Data: %s\n.'
                           % (e.message, query, str(data)))
 
-    @classmethod
-    def drop_revision(cls):
-        return cls.execute('DROP SCHEMA IF EXISTS %s' % cls.config['revision_schema_name'])
+    def run_statement(self, statement):
+        if not self.conn_initialized:
+            self.init_conn()
+        # alters run against db_name, which may not be the revision database.
+        # Either way the connection has the search_path set to schema_name.
+        if self.alter_conn is None:
+            if self.config.get('db_name', self.config.get('revision_db_name')) == self.config.get('revision_db_name'):
+                self.alter_conn = self.connection
+            else:
+                db_name = self.config['db_name']
+                search_path = self.config.get('schema_name')
+                self.alter_conn = ConnectionPool.acquire(self.pool_key(db_name),
+                                                         lambda: self.connect(db_name=db_name,
+                                                                              search_path=search_path),
+                                                         self.check_conn)
+        try:
+            cursor = self.alter_conn.cursor()
+            cursor.execute(statement)
+            self.alter_conn.commit()
+        except Exception, e:
+            self.alter_conn.rollback()
+            raise DbError('Psycopg2 execution error: %s\n. Statement: %s\n.' % (e.message, statement))
+
+    def drop_revision(self):
+        return self.execute('DROP SCHEMA IF EXISTS %s' % self.config['revision_schema_name'])
 
-    @classmethod
-    def create_revision(cls):
+    def create_revision(self):
         # Executing 'CREATE SCHEMA IF NOT EXISTS' fails if the user does not
         # have schema creation privileges, even if the schema already exists.
         # The correct action is to break this method into two parts: checking
@@ -91,74 +109,105 @@ class PostgresDb(Db):
         # The 'IF NOT EXISTS' flag is still used in case the database is
         # created after the existence check but before the CREATE statement.
         check = "SELECT EXISTS(SELECT 1 FROM pg_namespace WHERE nspname = %s)"
-        result = cls.execute(check, [cls.config['revision_schema_name']])
+        result = self.execute(check, [self.config['revision_schema_name']])
         if result[0] == (True,):
             return
         else:
-            return cls.execute('CREATE SCHEMA IF NOT EXISTS %s' % cls.config['revision_schema_name'])
+            return self.execute('CREATE SCHEMA IF NOT EXISTS %s' % self.config['revision_schema_name'])
 
-    @classmethod
-    def get_commit_history(cls):
-        return cls.execute('SELECT id, alter_hash, ran_on FROM %s' % cls.full_table_name)
+    def fetch_commit_history(self, descending=False):
+        """
+        Return an iterator over the history, ordered by id (newest first if
+        descending). Rows are fetched from a server-side cursor in batches as
+        they are consumed rather than all at once.
+        """
+        query = 'SELECT id, alter_hash, ran_on FROM %s ORDER BY id%s' % (
+            self.full_table_name, ' DESC' if descending else '')
+        return self.__stream(query)
 
-    @classmethod
-    def append_commit(cls, ref):
-        return cls.execute('INSERT INTO %s (alter_hash) VALUES (%s)' % (cls.full_table_name, '%s'),
-                           (ref,))
+    def __stream(self, query):
+        # the query only runs once iteration starts, so that an iterator that
+        # is dropped unused leaves no open cursor on the connection
+        if not self.conn_initialized:
+            self.init_conn()
+        try:
+            cursor = self.connection.cursor(name='schema_tool_history')
+            cursor.itersize = 1000
+            cursor.execute(query)
+        except Exception, e:
+            self.connection.rollback()
+            raise DbError('Psycopg2 execution error: %s\n. Query: %s\n.' % (e.message, query))
+        try:
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+            self.connection.commit()
 
-    @classmethod
-    def get_append_commit_query(cls, ref):
-        return "INSERT INTO %s (alter_hash, ran_on) VALUES ('%s', NOW())" % (cls.full_table_name, ref)
+    def append_commit(self, ref):
+        return self.execute('INSERT INTO %s (alter_hash) VALUES (%s)' % (self.full_table_name, '%s'),
+                            (ref,))
 
-    @classmethod
-    def remove_commit(cls, ref):
-        return cls.execute('DELETE FROM %s WHERE alter_hash = %s' % (cls.full_table_name, '%s'),
-                           (ref,))
+    def append_commits(self, refs):
+        values = ', '.join(['(%s)'] * len(refs))
+        return self.execute('INSERT INTO %s (alter_hash) VALUES %s' % (self.full_table_name, values),
+                            tuple(refs))
 
-    @classmethod
-    def get_remove_commit_query(cls, ref):
-        return "DELETE FROM %s WHERE alter_hash = '%s'" % (cls.full_table_name, ref)
+    def get_append_commit_query(self, ref):
+        return "INSERT INTO %s (alter_hash, ran_on) VALUES ('%s', NOW())" % (self.full_table_name, ref)
 
-    @classmethod
-    def create_history(cls):
-        return cls.execute("""CREATE TABLE IF NOT EXISTS %s (
+    def remove_commit(self, ref):
+        return self.execute('DELETE FROM %s WHERE alter_hash = %s' % (self.full_table_name, '%s'),
+                            (ref,))
+
+    def remove_commits(self, refs):
+        values = ', '.join(['%s'] * len(refs))
+        return self.execute('DELETE FROM %s WHERE alter_hash IN (%s)' % (self.full_table_name, values),
+                            tuple(refs))
+
+    def get_remove_commit_query(self, ref):
+        return "DELETE FROM %s WHERE alter_hash = '%s'" % (self.full_table_name, ref)
+
+    def create_history(self):
+        return self.execute("""CREATE TABLE IF NOT EXISTS %s (
         id serial NOT NULL,
         alter_hash VARCHAR(100) NOT NULL,
         ran_on timestamp NOT NULL DEFAULT current_timestamp,
         CONSTRAINT pk_%s__id PRIMARY KEY (id),
         CONSTRAINT uq_%s__alter_hash UNIQUE (alter_hash)
-        )""" % (cls.full_table_name, cls.history_table_name, cls.history_table_name))
+        )""" % (self.full_table_name, self.history_table_name, self.history_table_name))
+
+    def check_conn(self, conn):
+        # the rollback also ends any transaction left open by a failed query
+        try:
+            if conn.closed:
+                return False
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def close(self):
+        if self.alter_conn is not None and self.alter_conn is not self.connection:
+            ConnectionPool.release(self.pool_key(self.config['db_name']), self.alter_conn)
+        self.alter_conn = None
+        super(PostgresDb, self).close()
+
+    def conn(self):
+        """
+        return the postgres connection handle to the configured server, with the
+        search_path set to the configured schema for the whole session
+        """
+        return self.connect(search_path=self.config.get('schema_name'))
 
-    @classmethod
-    def conn(cls):
+    def connect(self, db_name=None, search_path=None):
         """
-        return the postgres connection handle to the configured server
+        open a new postgres connection to the configured server, connected to the
+        revision database unless another db_name is given. A search_path is
+        passed as a startup option, so that setting it costs no round trip.
         """
-        config = cls.config
         try:
-            # conn_string here
-            conn_string_parts = []
-            conn_string_params = []
-            for key, value in config.iteritems():
-                # Build connection string based on what is defined in the config
-                if value:
-                    if key == 'host':
-                        conn_string_parts.append('host=%s')
-                        conn_string_params.append(value)
-                    elif key == 'username':
-                        conn_string_parts.append('user=%s')
-                        conn_string_params.append(value)
-                    elif key == 'password':
-                        conn_string_parts.append('password=%s')
-                        conn_string_params.append(value)
-                    elif key == 'revision_db_name':
-                        conn_string_parts.append('dbname=%s')
-                        conn_string_params.append(value)
-                    elif key == 'port':
-                        conn_string_parts.append('port=%s')
-                        conn_string_params.append(value)
-            conn_string = ' '.join(conn_string_parts) % tuple(conn_string_params)
-            conn = psycopg2.connect(conn_string)
+            conn = psycopg2.connect(self.conn_string(db_name=db_name, search_path=search_path))
         except Exception, e:
             raise DbError("Cannot connect to Postgres Db: %s\n"
                           "Ensure that the server is running and you can connect normally"
@@ -166,25 +215,74 @@ class PostgresDb(Db):
 
         return conn
 
-    @classmethod
-    def run_file_cmd(cls, filename):
+    def conn_string(self, db_name=None, search_path=None):
         """
-        return a 3-tuple of strings containing:
-            the command to run (list)
+        return the libpq connection string for the configured server, built from
+        the keys defined in the config. Values are quoted, and the search_path
+        (a comma separated list of schemas) is escaped as libpq expects within
+        the startup options.
+        """
+        conn_string_parts = []
+        for (key, param) in [('host', 'host'),
+                             ('port', 'port'),
+                             ('username', 'user'),
+                             ('password', 'password'),
+                             ('revision_db_name', 'dbname')]:
+            value = self.config.get(key)
+            if value:
+                if key == 'revision_db_name':
+                    value = db_name or value
+                conn_string_parts.append('%s=%s' % (param, self.__quote(value)))
+        if search_path:
+            search_path = ','.join(schema.strip() for schema in search_path.split(','))
+            # within options, spaces separate arguments unless escaped
+            search_path = search_path.replace('\\', '\\\\').replace(' ', '\\ ')
+            conn_string_parts.append('options=%s' % self.__quote('-c search_path=%s' % search_path))
+        return ' '.join(conn_string_parts)
+
+    def __quote(self, value):
+        return "'%s'" % str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+    def client_cmd(self):
+        """
+        return a 2-tuple containing:
+            the command line client to run (list)
             environment variables to be passed to command (dictionary or None)
-            data to be piped into stdin (file-like object or None)
         """
-        port_number = str(cls.config.get('port', PostgresDb.DEFAULT_PORT))
+        port_number = str(self.config.get('port', PostgresDb.DEFAULT_PORT))
         cmd = ['psql',
-               '-h', cls.config['host'],
-               '-U', cls.config['username'],
+               '-h', self.config['host'],
+               '-U', self.config['username'],
                '-p', port_number,
                '-v', 'verbose',
                '-v', 'ON_ERROR_STOP=1',
-               '-v', 'schema=%s' % cls.config['schema_name'],
-               cls.config['db_name']]
+               '-v', 'schema=%s' % self.config['schema_name'],
+               self.config['db_name']]
         my_env = None
-        if 'password' in cls.config:
+        if 'password' in self.config:
             my_env = os.environ.copy()
-            my_env['PGPASSWORD'] = cls.config['password']
+            my_env['PGPASSWORD'] = self.config['password']
+        return cmd, my_env
+
+    def run_file_cmd(self, filename):
+        """
+        return a 3-tuple of strings containing:
+            the command to run (list)
+            environment variables to be passed to command (dictionary or None)
+            data to be piped into stdin (file-like object or None)
+        """
+        cmd, my_env = self.client_cmd()
         return cmd, my_env, open(filename)
+
+    def session_cmd(self):
+        """
+        return a 3-tuple containing:
+            the command to run for a long-lived client session (list)
+            environment variables to be passed to command (dictionary or None)
+            the statement (a format string, given a token) used to echo a marker
+        """
+        cmd, my_env = self.client_cmd()
+        # the marker goes through psql's own output, after that of the alter.
+        # Its output is buffered when not on a terminal, but flushed before
+        # each line of input is read, so the marker isn't held back.
+        return cmd, my_env, "\\echo %s\n"
@@ -13,44 +13,41 @@ except ImportError:
 
 # local imports
 from db import Db
+from pool import ConnectionPool
 from errors import DbError
 
 class VerticaDb(Db):
     DEFAULT_PORT=5433
+    SQL_DIALECT = 'postgres'
 
-    @classmethod
-    def new(cls, config):
-        super(VerticaDb, cls).new(config)
-        if 'revision_schema_name' in cls.config:
-            cls.history_table_name = cls.config['history_table_name']
-            cls.full_table_name = '"%s"."%s"' % (cls.config['revision_schema_name'],
-                                                 cls.config['history_table_name'])
+    def __init__(self, config):
+        super(VerticaDb, self).__init__(config)
+        if 'revision_schema_name' in self.config:
+            self.history_table_name = self.config['history_table_name']
+            self.full_table_name = '"%s"."%s"' % (self.config['revision_schema_name'],
+                                                  self.config['history_table_name'])
         else:
             raise DbError('No schema found in config file. Please add one with the key: '
                           'revision_schema_name')
+        self.alter_conn = None
 
-        return cls
-
-    @classmethod
-    def init_conn(cls):
+    def init_conn(self):
         try:
             vertica_python
         except NameError:
             raise DbError('Vertica module not found/loaded. Please make sure all dependencies are installed\n')
 
-        cls.conn = cls.conn()
-        cls.cursor = cls.conn.cursor()
+        self.connection = ConnectionPool.acquire(self.pool_key(), self.conn, self.check_conn)
+        self.cursor = self.connection.cursor()
 
-        cls.conn_initialized = True
-        return cls
+        self.conn_initialized = True
+        return self
 
-    @classmethod
-    def execute(cls, query, data=None):
-        if not cls.conn_initialized:
-            cls.init_conn()
+    def execute(self, query, data=None):
+        if not self.conn_initialized:
+            self.init_conn()
         try:
-            cursor = cls.cursor
-            cursor.execute('SET search_path TO %s' % cls.config['schema_name'])
+            cursor = self.cursor
             if data:
                 cursor.execute(query, data)
             else:
@@ -62,18 +59,41 @@ class VerticaDb(Db):
                     results = cursor.fetchall()
                 except vertica_python.ProgrammingError, e:
                     raise vertica_python.ProgrammingError(e.message)
-            cls.conn.commit()
+            self.connection.commit()
             return results
         except Exception, e:
             raise DbError('Vertica execution error: %s\n. Query: %s - Data: %s\n.'
                           % (e.message, query, str(data)))
 
-    @classmethod
-    def drop_revision(cls):
-        return cls.execute('DROP SCHEMA IF EXISTS %s' % cls.config['revision_schema_name'])
+    def run_statement(self, statement):
+        if not self.conn_initialized:
+            self.init_conn()
+        # alters run against db_name, which may not be the revision database.
+        # Either way the connection has the search_path set to schema_name.
+        if self.alter_conn is None:
+            if self.config.get('db_name', self.config.get('revision_db_name')) == self.config.get('revision_db_name'):
+                self.alter_conn = self.connection
+            else:
+                db_name = self.config['db_name']
+                search_path = self.config.get('schema_name')
+                self.alter_conn = ConnectionPool.acquire(self.pool_key(db_name),
+                                                         lambda: self.connect(db_name=db_name,
+                                                                              search_path=search_path),
+                                                         self.check_conn)
+        try:
+            cursor = self.alter_conn.cursor()
+            cursor.execute(statement)
+            if cursor.description:
+                cursor.fetchall()
+            self.alter_conn.commit()
+        except Exception, e:
+            self.alter_conn.rollback()
+            raise DbError('Vertica execution error: %s\n. Statement: %s\n.' % (e.message, statement))
+
+    def drop_revision(self):
+        return self.execute('DROP SCHEMA IF EXISTS %s' % self.config['revision_schema_name'])
 
-    @classmethod
-    def create_revision(cls):
+    def create_revision(self):
         # Executing 'CREATE SCHEMA IF NOT EXISTS' fails if the user does not
         # have schema creation privileges, even if the schema already exists.
         # The correct action is to break this method into two parts: checking
@@ -81,51 +101,106 @@ class VerticaDb(Db):
         #
         # The 'IF NOT EXISTS' flag is still used in case the database is
         # created after the existence check but before the CREATE statement.
-        check = "SELECT EXISTS(SELECT 1 FROM v_catalog.SCHEMATA WHERE schema_name = '%s')" % cls.config['revision_schema_name']
-        result = cls.execute(check)
+        check = "SELECT EXISTS(SELECT 1 FROM v_catalog.SCHEMATA WHERE schema_name = '%s')" % self.config['revision_schema_name']
+        result = self.execute(check)
         if result[0] == [True]:
             return
         else:
-            return cls.execute('CREATE SCHEMA IF NOT EXISTS %s' % cls.config['revision_schema_name'])
+            return self.execute('CREATE SCHEMA IF NOT EXISTS %s' % self.config['revision_schema_name'])
 
-    @classmethod
-    def get_commit_history(cls):
-        return cls.execute('SELECT * FROM %s' % cls.full_table_name)
+    def fetch_commit_history(self, descending=False):
+        """
+        Return an iterator over the history, ordered by id (newest first if
+        descending). Rows are read as they are consumed rather than all at
+        once.
+        """
+        query = 'SELECT id, alter_hash, ran_on FROM %s ORDER BY id%s' % (
+            self.full_table_name, ' DESC' if descending else '')
+        return self.__stream(query)
 
-    @classmethod
-    def append_commit(cls, ref):
-        return cls.execute('INSERT INTO %s (alter_hash) VALUES (%s)' % (cls.full_table_name, '%s'),
-                           (ref,))
+    def __stream(self, query):
+        # the query only runs once iteration starts, so that an iterator that
+        # is dropped unused leaves no unread result on the connection
+        if not self.conn_initialized:
+            self.init_conn()
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute(query)
+        except Exception, e:
+            raise DbError('Vertica execution error: %s\n. Query: %s\n.' % (e.message, query))
+        try:
+            for row in cursor.iterate():
+                yield row
+        finally:
+            # the connection can't be used again until the whole result is read
+            while cursor.fetchone():
+                pass
+            cursor.close()
+
+    def append_commit(self, ref):
+        return self.execute('INSERT INTO %s (alter_hash) VALUES (%s)' % (self.full_table_name, '%s'),
+                            (ref,))
+
+    def append_commits(self, refs):
+        # Vertica doesn't support multi-row VALUES lists
+        selects = ' UNION ALL '.join(['SELECT %s'] * len(refs))
+        return self.execute('INSERT INTO %s (alter_hash) %s' % (self.full_table_name, selects),
+                            tuple(refs))
+
+    def get_append_commit_query(self, ref):
+        return "INSERT INTO %s (alter_hash, ran_on) VALUES ('%s', NOW())" % (self.full_table_name, ref)
 
-    @classmethod
-    def get_append_commit_query(cls, ref):
-        return "INSERT INTO %s (alter_hash, ran_on) VALUES ('%s', NOW())" % (cls.full_table_name, ref)
+    def remove_commit(self, ref):
+        return self.execute('DELETE FROM %s WHERE alter_hash = %s' % (self.full_table_name, '%s'),
+                            (ref,))
 
-    @classmethod
-    def remove_commit(cls, ref):
-        return cls.execute('DELETE FROM %s WHERE alter_hash = %s' % (cls.full_table_name, '%s'),
-                           (ref,))
+    def remove_commits(self, refs):
+        values = ', '.join(['%s'] * len(refs))
+        return self.execute('DELETE FROM %s WHERE alter_hash IN (%s)' % (self.full_table_name, values),
+                            tuple(refs))
 
-    @classmethod
-    def get_remove_commit_query(cls, ref):
-        return "DELETE FROM %s WHERE alter_hash = '%s'" % (cls.full_table_name, ref)
+    def get_remove_commit_query(self, ref):
+        return "DELETE FROM %s WHERE alter_hash = '%s'" % (self.full_table_name, ref)
 
-    @classmethod
-    def create_history(cls):
-        return cls.execute("""CREATE TABLE IF NOT EXISTS %s (
+    def create_history(self):
+        return self.execute("""CREATE TABLE IF NOT EXISTS %s (
         id auto_increment NOT NULL,
         alter_hash VARCHAR(100) NOT NULL,
         ran_on timestamp NOT NULL DEFAULT current_timestamp,
         CONSTRAINT pk_%s__id PRIMARY KEY (id),
         CONSTRAINT uq_%s__alter_hash UNIQUE (alter_hash) ENABLED
-        )""" % (cls.full_table_name, cls.history_table_name, cls.history_table_name))
+        )""" % (self.full_table_name, self.history_table_name, self.history_table_name))
+
+    def check_conn(self, conn):
+        # the rollback also ends any transaction left open by a failed query
+        try:
+            if conn.closed():
+                return False
+            conn.rollback()
+        except Exception:
+            return False
+        return True
+
+    def close(self):
+        if self.alter_conn is not None and self.alter_conn is not self.connection:
+            ConnectionPool.release(self.pool_key(self.config['db_name']), self.alter_conn)
+        self.alter_conn = None
+        super(VerticaDb, self).close()
+
+    def conn(self):
+        """
+        return the vertica connection handle to the configured server, with the
+        search_path set to the configured schema for the whole session
+        """
+        return self.connect(search_path=self.config.get('schema_name'))
 
-    @classmethod
-    def conn(cls):
+    def connect(self, db_name=None, search_path=None):
         """
-        return the vertica connection handle to the configured server
+        open a new vertica connection to the configured server, connected to the
+        revision database unless another db_name is given, and with the
+        search_path set if one is given
         """
-        config = cls.config
+        config = self.config
         try:
             conn_driver_dict = {}
             conf_to_driver_map = {'host':'host',
@@ -142,6 +217,9 @@ class VerticaDb(Db):
                     if isinstance(driver_value, unicode):
                         driver_value = str(driver_value)
 
+                    if conf_key == 'revision_db_name' and db_name:
+                        driver_value = db_name
+
                     conn_driver_dict[driver_key] = driver_value
 
                 except KeyError:
@@ -153,28 +231,55 @@ class VerticaDb(Db):
                           "Ensure that the server is running and you can connect normally"
                           % e.message)
 
+        if search_path:
+            try:
+                conn.cursor().execute('SET search_path TO %s' % search_path)
+            except Exception, e:
+                conn.close()
+                raise DbError('Could not set search_path on the Vertica connection: %s' % e)
         return conn
 
-    @classmethod
-    def run_file_cmd(cls, filename):
+    def client_cmd(self):
         """
-        return a 3-tuple of strings containing:
-            the command to run (list)
+        return a 2-tuple containing:
+            the command line client to run (list)
             environment variables to be passed to command (dictionary or None)
-            data to be piped into stdin (file-like object or None)
         """
-        port_number = str(cls.config.get('port', VerticaDb.DEFAULT_PORT))
+        port_number = str(self.config.get('port', VerticaDb.DEFAULT_PORT))
         cmd = ['/opt/vertica/bin/vsql',
-               '-h', cls.config['host'],
-               '-U', cls.config['username'],
+               '-h', self.config['host'],
+               '-U', self.config['username'],
                '-p', port_number,
                '-v', 'VERBOSITY=verbose',
                '-v', 'AUTOCOMMIT=on',
                '-v', 'ON_ERROR_STOP=on',
-               '-v', 'schema=%s' % cls.config['schema_name'],
-               cls.config['db_name']]
+               '-v', 'schema=%s' % self.config['schema_name'],
+               self.config['db_name']]
         my_env = None
-        if 'password' in cls.config:
+        if 'password' in self.config:
             my_env = os.environ.copy()
-            my_env['VSQL_PASSWORD'] = cls.config['password']
+            my_env['VSQL_PASSWORD'] = self.config['password']
+        return cmd, my_env
+
+    def run_file_cmd(self, filename):
+        """
+        return a 3-tuple of strings containing:
+            the command to run (list)
+            environment variables to be passed to command (dictionary or None)
+            data to be piped into stdin (file-like object or None)
+        """
+        cmd, my_env = self.client_cmd()
         return cmd, my_env, open(filename)
+
+    def session_cmd(self):
+        """
+        return a 3-tuple containing:
+            the command to run for a long-lived client session (list)
+            environment variables to be passed to command (dictionary or None)
+            the statement (a format string, given a token) used to echo a marker
+        """
+        cmd, my_env = self.client_cmd()
+        # the marker goes through vsql's own output, after that of the alter.
+        # Its output is buffered when not on a terminal, but flushed before
+        # each line of input is read, so the marker isn't held back.
+        return cmd, my_env, "\\echo %s\n"
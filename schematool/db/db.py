@@ -1,95 +1,286 @@
 # stdlib imports
+import json
+import os
 import subprocess
 import sys
+from time import time
 
 # local imports
-from errors import AppliedAlterError
+from constants import Constants
+from errors import AppliedAlterError, DbError
+from pool import ConnectionPool
+from session import ClientSession
+from stream import StreamDrain
+from util import HistoryCache, SqlUtil
 
 # TODO: Move connection management to schema.py. Instantiate a connection
 # before each run() method and close it at the end, using the DB.conn() method.
 
 class Db(object):
     """
-    Do not instantiate directly.
+    Do not instantiate directly, use new() on one of the subclasses.
     Contains all the methods related to initialization of the environment that the
-    script will be running in.
+    script will be running in. Each instance holds its own config and connection.
     """
+    # Dialect used to split alters into statements in the 'driver' execution
+    # mode (see SqlUtil.split_statements), None if the mode is not supported
+    SQL_DIALECT = None
+
+    def __init__(self, config):
+        self.config = config
+        self.conn_initialized = False
+        # the connection from the pool (see init_conn), conn() opens new ones
+        self.connection = None
+        self.session = None
+        self.history_batch = int(config.get('history_batch', 1))
+        self.pending_action = None
+        self.pending_refs = []
+        self.history_cache = None
 
     @classmethod
     def new(cls, config):
-        cls.config = config
-        cls.conn_initialized = False
-
-        return cls
+        return cls(config)
 
-    @classmethod
-    def init(cls, force=False):
+    def init(self, force=False):
         """
         Make sure that the table to track revisions is there.
         """
 
         if force:
             sys.stdout.write('Removing existing history')
-            cls.drop_revision()
+            self.drop_revision()
 
         sys.stdout.write('Creating revision database\n')
-        cls.create_revision()
+        self.create_revision()
         sys.stdout.write('Creating history table\n')
-        cls.create_history()
+        self.create_history()
         sys.stdout.write('DB Initialized\n')
 
-    @classmethod
-    def run_up(cls, alter, force=False, verbose=False):
+    def run_up(self, alter, force=False, verbose=False):
         """
         Run the up-alter against the DB
         """
         sys.stdout.write('Running alter: %s\n' % alter.filename)
         filename = alter.abs_filename()
-        cls._run_file(filename=filename, exit_on_error=not force, verbose=verbose)
+        try:
+            self._run_file(filename=filename, exit_on_error=not force, verbose=verbose)
+        except:
+            self.flush_commits(quiet=True)
+            raise
 
-        cls.append_commit(ref=alter.id)
+        self._record_commit('append', alter.id)
 
-    @classmethod
-    def run_down(cls, alter, force=False, verbose=False):
+    def run_down(self, alter, force=False, verbose=False):
         """
         Run the down-alter against the DB
         """
         sys.stdout.write('Running alter: %s\n' % alter.down_filename())
         filename = alter.abs_filename(direction='down')
-        cls._run_file(filename=filename, exit_on_error=not force, verbose=verbose)
+        try:
+            self._run_file(filename=filename, exit_on_error=not force, verbose=verbose)
+        except:
+            self.flush_commits(quiet=True)
+            raise
 
-        cls.remove_commit(ref=alter.id)
+        self._record_commit('remove', alter.id)
+
+    def _record_commit(self, action, ref):
+        """
+        Record that an alter was run ('append') or undone ('remove'). With a
+        'history_batch' larger than 1, records are buffered and written
+        'history_batch' at a time (see flush_commits), so that a crash leaves at
+        most one batch of alters unrecorded.
+        """
+        if self.history_batch <= 1:
+            if action == 'append':
+                self.append_commit(ref=ref)
+            else:
+                self.remove_commit(ref=ref)
+            return
+
+        # records are written in order, so a batch only holds one kind
+        if self.pending_action != action:
+            self.flush_commits()
+            self.pending_action = action
+        self.pending_refs.append(ref)
+        if len(self.pending_refs) >= self.history_batch:
+            self.flush_commits()
+
+    def flush_commits(self, quiet=False):
+        """
+        Write any buffered history records (see _record_commit). With quiet, as
+        used while another error is handled, an error is written to stderr
+        rather than raised so that it doesn't hide the original one.
+        """
+        refs = self.pending_refs
+        if not refs:
+            return
+        self.pending_refs = []
+        try:
+            if self.pending_action == 'append':
+                self.append_commits(refs)
+            else:
+                self.remove_commits(refs)
+        except Exception, ex:
+            if not quiet:
+                raise
+            sys.stderr.write("Error: Could not record %d alter(s) in the history: %s\n" % (len(refs), ex))
+
+    def append_commits(self, refs):
+        """
+        Record several alters as run. Backends override this to use a single
+        query.
+        """
+        for ref in refs:
+            self.append_commit(ref=ref)
+
+    def remove_commits(self, refs):
+        """
+        Remove the history records of several alters. Backends override this
+        to use a single query.
+        """
+        for ref in refs:
+            self.remove_commit(ref=ref)
+
+    def _run_file(self, filename, exit_on_error=True, verbose=False):
+        if self.config.get('execution') == 'session':
+            return self._run_file_in_session(filename, exit_on_error, verbose)
+        elif self.config.get('execution') == 'driver':
+            return self._run_file_with_driver(filename, exit_on_error, verbose)
 
-    @classmethod
-    def _run_file(cls, filename, exit_on_error=True, verbose=False):
         # Used for testing to simulate an error in the running of an alter file
-        if getattr(cls, 'auto_throw_error', False) and 'error' in filename:
-            command, my_env, stdin_stream = cls.run_file_cmd_with_error(filename)
+        if getattr(self, 'auto_throw_error', False) and 'error' in filename:
+            command, my_env, stdin_stream = self.run_file_cmd_with_error(filename)
         else:
-            command, my_env, stdin_stream = cls.run_file_cmd(filename)
+            command, my_env, stdin_stream = self.run_file_cmd(filename)
 
-        if stdin_stream:
-            proc = subprocess.Popen(command,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    env=my_env)
+        # The alter file is handed to the client as its stdin and is never read
+        # here. Output is drained as it arrives, and with verbose it is echoed
+        # live (in which case it isn't repeated in the report).
+        proc = subprocess.Popen(command,
+                                stdin=stdin_stream,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                env=my_env)
+        try:
+            out_drain = StreamDrain(proc.stdout, echo=sys.stdout if verbose else None)
+            err_drain = StreamDrain(proc.stderr, echo=sys.stderr if verbose else None)
+            proc.wait()
+            out_drain.join()
+            err_drain.join()
+        finally:
+            if stdin_stream:
+                stdin_stream.close()
 
-            script = open(filename)
-            out, err = proc.communicate(script.read())
-        else:
-            proc = subprocess.Popen(command,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    env=my_env)
-            out, err = proc.communicate()
+        out, err = out_drain.take(), err_drain.take()
+        if verbose:
+            out, err = '', ''
+        self._report_run(filename, proc.returncode == 0, out, err, exit_on_error, verbose)
+
+    def _run_file_in_session(self, filename, exit_on_error=True, verbose=False):
+        """
+        Run the alter file through a client session that is kept open for the
+        rest of the run (see ClientSession), starting a new one if there is
+        none yet or the previous one exited after an error.
+        """
+        if self.session is None or not self.session.is_alive():
+            session_cmd = self.session_cmd()
+            if session_cmd is None:
+                raise DbError("The 'session' execution mode is not supported by this database type\n")
+            command, my_env, marker = session_cmd
+            timeout = float(self.config.get('session_timeout', 3600)) or None
+            self.session = ClientSession(command, my_env, marker, timeout)
+
+        success, out, err = self.session.run(filename)
+        self._report_run(filename, success, out, err, exit_on_error, verbose)
+
+    def _run_file_with_driver(self, filename, exit_on_error=True, verbose=False):
+        """
+        Split the alter file into statements and run them one by one over the
+        driver connection (see run_statement), instead of through the command
+        line client. With verbose, the time taken by each statement is printed.
+        """
+        if self.SQL_DIALECT is None:
+            raise DbError("The 'driver' execution mode is not supported by this database type\n")
+
+        script = open(filename)
+        try:
+            statements = SqlUtil.split_statements(script.read(), self.SQL_DIALECT)
+        finally:
+            script.close()
+
+        err = ''
+        for statement in statements:
+            start = time()
+            try:
+                self.run_statement(statement)
+            except DbError, ex:
+                err = str(ex)
+                break
+            if verbose:
+                sys.stdout.write('  %.3fs  %s\n' % (time() - start, statement.split('\n')[0]))
+
+        self._report_run(filename, not err, '', err, exit_on_error, verbose)
+
+    def run_statement(self, statement):
+        """
+        Run a single statement of an alter over the driver connection. Used by
+        the 'driver' execution mode.
+        """
+        raise DbError("The 'driver' execution mode is not supported by this database type\n")
 
+    def pool_key(self, db_name=None):
+        """
+        Return what identifies the connections of this DB in the connection
+        pool: the backend and every config value that affects the connection
+        """
+        params = tuple((k, self.config.get(k)) for k in
+                       ('host', 'port', 'username', 'password', 'revision_db_name', 'schema_name'))
+        return (self.__class__.__name__, db_name, params)
+
+    def check_conn(self, conn):
+        """
+        Check that a pooled connection can still be used before it's reused
+        (see ConnectionPool.acquire)
+        """
+        return True
+
+    def close(self):
+        """
+        Hand the connection back to the connection pool. The DB can still be
+        used afterwards, it will get a connection again when needed.
+        """
+        if self.conn_initialized:
+            conn = self.connection
+            self.connection = None
+            self.conn_initialized = False
+            ConnectionPool.release(self.pool_key(), conn)
+
+    def end_session(self):
+        """
+        Close the client session used by the 'session' execution mode, if any
+        """
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def session_cmd(self):
+        """
+        return a 3-tuple containing:
+            the command to run for a long-lived client session (list)
+            environment variables to be passed to command (dictionary or None)
+            the statement (a format string, given a token) used to echo a marker
+        or None if sessions are not supported
+        """
+        return None
+
+    def _report_run(self, filename, success, out, err, exit_on_error, verbose):
         if err:
             sys.stderr.write("\n----------------------\n")
             sys.stderr.write(out.rstrip())
             sys.stderr.write(err.rstrip())
             sys.stderr.write("\n----------------------\n")
-        if not proc.returncode == 0:
+        if not success:
             sys.stderr.write('Error')
             if verbose:
                 sys.stderr.write("\n----------------------\n")
@@ -100,8 +291,74 @@ class Db(object):
             if exit_on_error:
                 raise AppliedAlterError('%s execution unsuccessful' % filename)
 
-    @classmethod
-    def get_applied_alters(cls):
-        results = cls.execute('SELECT alter_hash FROM %s' % cls.full_table_name)
-        alters_hashes = [result[0] for result in results]
-        return alters_hashes
+    def get_commit_history(self, descending=False):
+        """
+        Return an iterator over the history, as (id, alter_hash, ran_on) rows
+        ordered by id (newest first if descending). With a 'history_cache'
+        configured, the history is kept on disk and only read from the DB
+        again when it has changed (see history_probe), in which case ran_on is
+        given as a string.
+        """
+        if not self.config.get('history_cache'):
+            return self.fetch_commit_history(descending)
+        history = self.__cached_history()
+        if descending:
+            return reversed(history)
+        return iter(history)
+
+    def get_applied_alters(self):
+        """
+        Return the set of ids of the alters that have been run, from the
+        history cache if configured (see get_commit_history)
+        """
+        if not self.config.get('history_cache'):
+            return self.fetch_applied_alters()
+        return set(alter_hash for (_, alter_hash, _) in self.__cached_history())
+
+    def history_probe(self):
+        """
+        Return a cheap summary of the history (its highest id, number of rows
+        and latest ran_on) that changes whenever an alter is recorded or
+        removed.
+
+        It can miss a change that leaves all three as they were: an alter
+        removed and another recorded within the same second on a DB that
+        reuses ids (MySQL may reuse AUTO_INCREMENT values after a restart, and
+        Hive ids only have a one-second resolution). Remove the history cache
+        file if the history was changed that way.
+        """
+        results = self.execute('SELECT MAX(id), COUNT(*), MAX(ran_on) FROM %s' % self.full_table_name)
+        return list(results[0])
+
+    def history_key(self):
+        """
+        Return what identifies the history of this DB in the history cache
+        """
+        return json.dumps([self.__class__.__name__] +
+                          [self.config.get(k) for k in ('host', 'port', 'revision_db_name',
+                                                        'revision_schema_name', 'history_table_name')])
+
+    def __cached_history(self):
+        """
+        Return the history (ordered by id) from the history cache, reading it
+        from the DB and updating the cache if it changed since it was stored
+        """
+        if self.history_cache is None:
+            filename = os.path.join(Constants.ALTER_DIR, self.config['history_cache'])
+            self.history_cache = HistoryCache(filename)
+        key = self.history_key()
+        (max_id, count, max_ran_on) = self.history_probe()
+        probe = [int(max_id) if max_id is not None else None, int(count),
+                 str(max_ran_on) if max_ran_on is not None else None]
+
+        history = self.history_cache.get(key, probe)
+        if history is None:
+            history = [(int(id), alter_hash, str(ran_on) if ran_on is not None else None)
+                       for (id, alter_hash, ran_on) in self.fetch_commit_history()]
+            self.history_cache.put(key, probe, history)
+            self.history_cache.save()
+        return history
+
+    def fetch_applied_alters(self):
+        results = self.execute('SELECT alter_hash FROM %s' % self.full_table_name)
+        return set(result[0] for result in results)
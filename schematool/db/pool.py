@@ -0,0 +1,109 @@
+# stdlib imports
+import threading
+from time import time
+
+class ConnectionPool(object):
+    """
+    Keeps connections that are no longer used around for reuse, so that a
+    process running many commands one after the other (a daemon, or a
+    library user) connects once per database instead of once per command.
+
+    Connections are keyed by everything that identifies what they connect to
+    (see Db.pool_key). At most 'pool_size' idle connections are kept per key,
+    and connections idle for longer than 'pool_idle_timeout' seconds are
+    closed. A connection is health-checked before it is handed out again.
+    """
+    max_size = 1
+    idle_timeout = 300
+    idle = {}
+    lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, config):
+        """
+        Set the size of the pool ('pool_size', 0 disables pooling) and how long
+        connections may be idle ('pool_idle_timeout') from the config
+        """
+        cls.max_size = int(config.get('pool_size', 1))
+        cls.idle_timeout = float(config.get('pool_idle_timeout', 300))
+
+    @classmethod
+    def acquire(cls, key, connect, check=None):
+        """
+        Return an idle connection for the given key that passes check(conn),
+        or a new one from connect()
+        """
+        while True:
+            with cls.lock:
+                expired = cls.__evict()
+                conns = cls.idle.get(key)
+                conn = conns.pop()[0] if conns else None
+            cls.__close(*expired)
+            if conn is None:
+                return connect()
+            if check is None or check(conn):
+                return conn
+            cls.__close(conn)
+
+    @classmethod
+    def release(cls, key, conn):
+        """
+        Give back a connection that is no longer used, closing it if the pool
+        for its key is full
+        """
+        with cls.lock:
+            expired = cls.__evict()
+            conns = cls.idle.setdefault(key, [])
+            if len(conns) < cls.max_size:
+                conns.append((conn, time()))
+            else:
+                expired.append(conn)
+        cls.__close(*expired)
+
+    @classmethod
+    def clear(cls):
+        """
+        Close all idle connections
+        """
+        with cls.lock:
+            conns = [conn for entries in cls.idle.values() for (conn, _) in entries]
+            cls.idle = {}
+        cls.__close(*conns)
+
+    @classmethod
+    def reset(cls):
+        """
+        Forget all idle connections without closing them and restore the
+        default settings. Used in a forked process, where the idle connections
+        are shared with the parent (closing them would close the parent's), and
+        in tests.
+        """
+        cls.max_size = 1
+        cls.idle_timeout = 300
+        cls.idle = {}
+        cls.lock = threading.Lock()
+
+    @classmethod
+    def __evict(cls):
+        """
+        Drop the connections that have been idle for too long, returning them
+        so they can be closed (outside of the lock)
+        """
+        expired = []
+        now = time()
+        for (key, conns) in cls.idle.items():
+            keep = [(conn, released) for (conn, released) in conns if now - released <= cls.idle_timeout]
+            expired.extend(conn for (conn, released) in conns if now - released > cls.idle_timeout)
+            if keep:
+                cls.idle[key] = keep
+            else:
+                del cls.idle[key]
+        return expired
+
+    @classmethod
+    def __close(cls, *conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,194 @@
+# stdlib imports
+import Queue
+import re
+import subprocess
+import threading
+import time
+import uuid
+
+# local imports
+from errors import DbError
+
+DELIMITER_LINE_REGEX = re.compile('^[ \t]*delimiter[ \t]+(\S+)[ \t]*$', re.IGNORECASE)
+
+class ClientSession(object):
+    """
+    A long-lived command line client (mysql, psql, vsql) that alter files are
+    fed to one after the other through its stdin. After each alter a marker
+    statement is sent that echoes a unique token; seeing the token on stdout
+    means every statement of the alter ran. If the client exits before the
+    token shows up, the alter failed (the clients are run so that they stop
+    at the first error).
+
+    A MySQL DELIMITER left active by an alter is reset to ';' before the
+    marker, so that neither the marker nor the next alter are swallowed.
+    Other client state (variables, temporary tables) carries over from one
+    alter to the next. An alter that leaves the client waiting for more
+    input (an unterminated quote or comment) never lets the marker through,
+    so the client is killed if the marker hasn't shown up within 'timeout'
+    seconds (None to wait forever).
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, command, env, marker, timeout=None):
+        self.marker = marker
+        self.timeout = timeout
+        self.nonce = uuid.uuid4().hex
+        self.count = 0
+        self.proc = subprocess.Popen(command,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     env=env)
+
+        # stderr is drained in the background so the client can never block on it
+        self.err = []
+        self.err_lock = threading.Lock()
+        self.err_thread = threading.Thread(target=self.__drain_stderr)
+        self.err_thread.daemon = True
+        self.err_thread.start()
+
+        # stdout is read in the background as well, so that waiting for the
+        # marker can time out
+        self.lines = Queue.Queue()
+        self.out_thread = threading.Thread(target=self.__read_stdout)
+        self.out_thread.daemon = True
+        self.out_thread.start()
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def run(self, filename):
+        """
+        Run the given alter file in the session.
+
+        Returns a 3-tuple of whether the alter was successful, and the output
+        (stdout and stderr) of the client while running it
+        """
+        self.count += 1
+        token = 'schema-tool-%s-%d' % (self.nonce, self.count)
+
+        # write from a separate thread, the client may fill up stdout while we
+        # are still feeding it
+        writer = threading.Thread(target=self.__write_alter, args=(filename, token))
+        writer.daemon = True
+        writer.start()
+
+        out = []
+        success = False
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while True:
+            try:
+                if deadline is None:
+                    # a timeout (however long) keeps the wait interruptible
+                    line = self.lines.get(True, 3600)
+                else:
+                    line = self.lines.get(True, max(deadline - time.time(), 0))
+            except Queue.Empty:
+                if deadline is None:
+                    continue
+                try:
+                    self.proc.kill()
+                except OSError:
+                    pass
+                self.close()
+                raise DbError('No answer from the client %ds after running %s. The alter may '
+                              'leave a quote or comment unterminated.\n' % (self.timeout, filename))
+            if line is None:
+                break
+            if line.strip() == token:
+                success = True
+                break
+            out.append(line)
+
+        writer.join()
+        if not success:
+            self.proc.wait()
+            self.err_thread.join()
+
+        with self.err_lock:
+            err = ''.join(self.err)
+            self.err = []
+
+        return (success, ''.join(out), err)
+
+    def close(self):
+        """
+        End the session, letting the client exit on its own
+        """
+        try:
+            self.proc.stdin.close()
+        except IOError:
+            pass
+        self.proc.wait()
+        self.out_thread.join()
+        self.err_thread.join()
+
+    def __write_alter(self, filename, token):
+        tail = ''
+        delimiter = ';'
+        partial = ''
+        try:
+            alter_file = open(filename)
+            try:
+                while True:
+                    chunk = alter_file.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.proc.stdin.write(chunk)
+                    tail = (tail + chunk)[-self.CHUNK_SIZE:]
+
+                    # follow DELIMITER commands, which only take up a line
+                    lines = (partial + chunk).split('\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        delimiter = self.__delimiter(line, delimiter)
+                delimiter = self.__delimiter(partial, delimiter)
+            finally:
+                alter_file.close()
+
+            # The marker must not be glued onto an unterminated last statement
+            suffix = '\n'
+            if self.__needs_terminator(tail, delimiter):
+                suffix += delimiter + '\n'
+            if delimiter != ';':
+                suffix += 'DELIMITER ;\n'
+            self.proc.stdin.write(suffix + (self.marker % token))
+            self.proc.stdin.flush()
+        except (IOError, ValueError):
+            # the client has exited (broken pipe) or the session was closed,
+            # which is picked up by run()
+            pass
+
+    def __delimiter(self, line, delimiter):
+        """
+        Return the delimiter in effect after the given line
+        """
+        match = DELIMITER_LINE_REGEX.match(line.rstrip('\r'))
+        if match is not None:
+            return match.group(1)
+        return delimiter
+
+    def __needs_terminator(self, tail, delimiter):
+        """
+        Given the end of an alter, check if its last statement (ignoring blank,
+        comment and DELIMITER lines) is left without a terminating delimiter
+        """
+        for line in reversed(tail.splitlines()):
+            line = line.strip()
+            if not line or line.startswith('--') or DELIMITER_LINE_REGEX.match(line):
+                continue
+            return not line.endswith(delimiter)
+        return False
+
+    def __read_stdout(self):
+        for line in iter(self.proc.stdout.readline, ''):
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def __drain_stderr(self):
+        for line in iter(self.proc.stderr.readline, ''):
+            with self.err_lock:
+                self.err.append(line)
@@ -0,0 +1,58 @@
+# stdlib imports
+import os
+import threading
+
+class StreamDrain(object):
+    """
+    Reads a pipe (e.g. a client's stdout or stderr) in the background as data
+    arrives, so that the client never blocks on a full pipe. Only the last
+    `limit` bytes are kept for error reporting, keeping memory flat no matter
+    how much the client prints. Optionally everything is also echoed to
+    another stream as it is read.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, pipe, echo=None, limit=1024 * 1024):
+        self.pipe = pipe
+        self.echo = echo
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.__drain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def take(self):
+        """
+        Return (and forget) what has been read so far
+        """
+        with self.lock:
+            data = ''.join(self.chunks)
+            if self.dropped:
+                data = '[... %d bytes of output omitted ...]\n%s' % (self.dropped, data)
+            self.chunks = []
+            self.size = 0
+            self.dropped = 0
+        return data
+
+    def __drain(self):
+        fd = self.pipe.fileno()
+        while True:
+            chunk = os.read(fd, self.CHUNK_SIZE)
+            if not chunk:
+                break
+            if self.echo is not None:
+                self.echo.write(chunk)
+                self.echo.flush()
+            with self.lock:
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+                while self.size > self.limit and len(self.chunks) > 1:
+                    dropped = self.chunks.pop(0)
+                    self.size -= len(dropped)
+                    self.dropped += len(dropped)
@@ -1,3 +1,4 @@
+from array import array
 import os
 import re
 import sys
@@ -9,17 +10,24 @@ class SimpleNode(object):
     """
     Represents a simple node within the alter chain. Just makes things
     a little easier and what not.
+
+    Nodes are kept small (no per-instance __dict__) since a chain can hold
+    tens of thousands of them.
     """
+    __slots__ = ('id', 'backref', 'meta', 'filename', 'is_applied', 'require_env', 'skip_env')
+
+    re_num       = re.compile('^\d{12}-')
+    re_direction = re.compile('-(up|down).sql$')
+
     def __init__(self, id, filename):
         self.id = id
         self.backref = None
         self.meta = {}
         self.filename = filename
 
-        self.re_num       = re.compile('^\d{12}-')
-        self.re_direction = re.compile('-(up|down).sql$')
-
         self.is_applied = None
+        self.require_env = None
+        self.skip_env = None
 
     def __str__(self, recursive=True):
         out = ''
@@ -55,3 +63,50 @@ class SimpleNode(object):
         else:
             sys.stderr.write("%s is not a valid alter-direction" % direction)
             return None
+
+
+class ChainArray(object):
+    """
+    Struct-of-arrays view of a (linked) alter chain, ordered from the first
+    alter to the last. Meant for bulk operations that would otherwise walk
+    the chain over and over, such as looking up many refs at once.
+
+    backrefs holds the index of each alter's parent within the arrays (-1 for
+    the head of the chain).
+    """
+    __slots__ = ('nodes', 'ids', 'backrefs', 'filenames', '_index')
+
+    def __init__(self, tail):
+        nodes = []
+        while tail is not None:
+            nodes.append(tail)
+            tail = tail.backref
+        nodes.reverse()
+
+        self.nodes = nodes
+        self.ids = [n.id for n in nodes]
+        self.filenames = [n.filename for n in nodes]
+        # taken from the links themselves rather than assumed from the order
+        positions = dict((id(node), i) for (i, node) in enumerate(nodes))
+        self.backrefs = array('l', (positions[id(node.backref)] if node.backref is not None else -1
+                                    for node in nodes))
+        self._index = dict((id, i) for (i, id) in enumerate(self.ids))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def index(self, id):
+        """
+        Return the position of the given ref within the chain, or -1 if it is
+        not part of the chain
+        """
+        return self._index.get(id, -1)
+
+    def find(self, id):
+        """
+        Return the node for the given ref, or None if it is not part of the chain
+        """
+        i = self.index(id)
+        if i == -1:
+            return None
+        return self.nodes[i]
@@ -27,7 +27,7 @@ from traceback import print_exc
 
 # local imports
 from constants import Constants
-from command import CommandContext
+from command import CommandContext, FleetRunner
 import errors
 
 # Import commands
@@ -35,7 +35,7 @@ import errors
 # and the mapping in Constants
 from command import (ListCommand, GenSqlCommand, UpCommand, ResolveCommand, 
                      GenRefCommand, NewCommand, RebuildCommand, Command, 
-                     CheckCommand, InitCommand, DownCommand)
+                     CheckCommand, InitCommand, DownCommand, PlanCommand)
 
 
 def main():
@@ -50,6 +50,7 @@ def main():
         "  list        List the current alter chain",
         "  up          Bring up to particular revision",
         "  down        Roll back to a particular revision",
+        "  plan        Show what up (or down) would run, as JSON",
         "  rebuild     Run the entire database down and back up (hard refresh)",
         "  gen-ref     Generate new file-ref",
         "  gen-sql     Generate SQL (DBA Files) for a given reference, including revision-history alter(s)",
@@ -73,9 +74,19 @@ def main():
         parser.print_help()
         sys.exit(0)
 
-    # load and validate config
+    # load and validate config. With a fleet, the base config may hold no
+    # connection settings, so the config of each target is validated instead.
     config = load_config()
-    config_errors = CommandContext.validate_config(config)
+    fleet = None
+    if config.get('fleet') and sys.argv[1] in Constants.FLEET_COMMANDS:
+        try:
+            fleet = FleetRunner(config)
+        except errors.ConfigFileError, e:
+            sys.stderr.write("Error: %s\n" % e)
+            sys.exit(1)
+        config_errors = fleet.validate_configs()
+    else:
+        config_errors = CommandContext.validate_config(config)
     if not len(config_errors) == 0:
         sys.stderr.write("Error: Configurations are not valid:\n")
         for error in config_errors:
@@ -88,11 +99,24 @@ def main():
         # strip command-name from arguments
         sys.argv = sys.argv[1:]
 
-        # Create context and select handler and attempt to dispatch
-        context = CommandContext.via(config)
+        # Create context and select handler and attempt to dispatch. With a
+        # fleet, the context (only used to parse the options here) is built
+        # from the config of the first target.
+        context = CommandContext.via(fleet.configs()[0][1] if fleet else config)
         handler = [c['handler'] for c in Constants.COMMANDS if c['command'] == user_command][0]
         try:
-            globals()[handler](context).run()
+            if fleet:
+                (options, _) = globals()[handler](context).parser.parse_args()
+                fleet.run(handler, sys.argv, parallel=options.parallel)
+            else:
+                command = globals()[handler](context)
+                if user_command in Constants.FLEET_COMMANDS:
+                    (options, _) = command.parser.parse_args()
+                    if options.parallel is not None:
+                        raise errors.OptionsError("--parallel only applies with a 'fleet' config",
+                                                  command.parser.format_help())
+                command.run()
+            context.db.flush_commits()
 
         # Errors that are caught by the application code
         except tuple([i[1] for i in inspect.getmembers(errors) if inspect.isclass(i[1])]), e:
@@ -112,6 +136,12 @@ def main():
                 sys.stderr.write("Error: %s\n\n" % ex)
                 print_exc()
             sys.exit(1)
+
+        # Record any alters that ran before an error (see Db.flush_commits),
+        # without hiding the error, and give back the connection
+        finally:
+            context.db.flush_commits(quiet=True)
+            context.db.close()
     else:
         sys.stderr.write("No command '%s' defined\n\n" % sys.argv[1])
         parser.print_help()
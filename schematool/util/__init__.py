@@ -6,5 +6,8 @@
 #    from util.chain_util import ChainUtil
 
 
+from cache import ChainCache, HistoryCache, StaticManifest, TailCache
 from chain import ChainUtil
 from metadata import MetaDataUtil
+from plan import Plan, PlanUtil
+from sql import SqlUtil
@@ -0,0 +1,314 @@
+import json
+import os
+
+class ChainCache(object):
+    """
+    On-disk cache of the meta-data parsed from the head of each alter file.
+    Entries are keyed by filename and are only trusted as long as the file's
+    mtime, size and inode are unchanged, so that building the chain only has
+    to stat each file rather than open and parse it.
+    """
+    VERSION = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        """
+        Read the cache file from disk. A missing, unreadable or outdated cache
+        is treated as empty (it will simply be rebuilt).
+        """
+        try:
+            cache_file = open(self.filename)
+            try:
+                data = json.load(cache_file)
+            finally:
+                cache_file.close()
+        except (IOError, OSError, ValueError):
+            return
+
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return
+        self.entries = data.get('files', {})
+
+    def get(self, filename, stat):
+        """
+        Return a 2-tuple of (direction, meta-data) for the given file if the
+        cached entry is still valid for the given stat result, else None.
+        """
+        entry = self.entries.get(filename)
+        if entry is None or entry['key'] != self.__stat_key(stat):
+            return None
+
+        direction = entry['direction']
+        if direction is not None:
+            direction = direction.encode('utf-8')
+        meta = dict((k.encode('utf-8'), v.encode('utf-8')) for (k, v) in entry['meta'].iteritems())
+        return (direction, meta)
+
+    def put(self, filename, stat, direction, meta):
+        """
+        Store the parsed direction and meta-data for the given file
+        """
+        self.entries[filename] = {
+            'key': self.__stat_key(stat),
+            'direction': direction,
+            'meta': meta
+        }
+        self.dirty = True
+
+    def prune(self, filenames):
+        """
+        Drop the entries of any files that are no longer in the given list
+        """
+        filenames = set(filenames)
+        for filename in self.entries.keys():
+            if filename not in filenames:
+                del self.entries[filename]
+                self.dirty = True
+
+    def save(self):
+        """
+        Write the cache back to disk if anything has changed. The file is
+        written to a temporary location and renamed into place so that a
+        concurrent reader never sees a partial cache. Failures are ignored
+        since the cache is only an optimization.
+        """
+        if not self.dirty:
+            return
+
+        tmp_filename = '%s.%s.tmp' % (self.filename, os.getpid())
+        try:
+            cache_file = open(tmp_filename, 'w')
+            try:
+                json.dump({'version': self.VERSION, 'files': self.entries}, cache_file)
+            finally:
+                cache_file.close()
+            os.rename(tmp_filename, self.filename)
+            self.dirty = False
+        except (IOError, OSError):
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def __stat_key(self, stat):
+        return [stat.st_mtime, stat.st_size, stat.st_ino]
+
+
+class TailCache(object):
+    """
+    Small on-disk record of the last alter in the chain, so that creating a
+    new alter doesn't require building the whole chain. The record is keyed
+    by the state of the alter directory (mtime and number of alter files) and
+    is only trusted while that state is unchanged.
+
+    The file is rewritten in place rather than renamed into place. A rename
+    would itself change the mtime of the directory it lives in (usually the
+    alter directory), invalidating the record it just wrote.
+    """
+    VERSION = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        if not os.path.exists(self.filename):
+            self.__write({})
+
+    def get(self, key):
+        """
+        Return a 2-tuple of the (id, filename) of the tail if the record
+        matches the given key, else None. Both values are None for an empty
+        chain.
+        """
+        try:
+            cache_file = open(self.filename)
+            try:
+                data = json.load(cache_file)
+            finally:
+                cache_file.close()
+        except (IOError, OSError, ValueError):
+            return None
+
+        if not isinstance(data, dict) or data.get('version') != self.VERSION or data.get('key') != key:
+            return None
+
+        tail = (data['id'], data['filename'])
+        return tuple(t.encode('utf-8') if t is not None else None for t in tail)
+
+    def put(self, key, id, filename):
+        """
+        Record the tail of the chain for the given key
+        """
+        self.__write({'version': self.VERSION, 'key': key, 'id': id, 'filename': filename})
+
+    def __write(self, data):
+        # Failures are ignored since the cache is only an optimization.
+        try:
+            cache_file = open(self.filename, 'w')
+            try:
+                json.dump(data, cache_file)
+            finally:
+                cache_file.close()
+        except (IOError, OSError):
+            pass
+
+
+class HistoryCache(object):
+    """
+    On-disk copy of the history table of each DB (target), so that commands
+    that only read the history don't have to download all of it on every
+    run. An entry is only trusted as long as the probe it was stored with
+    (the highest id, number of rows and latest ran_on of the history, see
+    Db.history_probe) matches the one taken from the DB.
+    """
+    VERSION = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.targets = self.__read()
+        self.updated = {}
+
+    def get(self, key, probe):
+        """
+        Return the history rows stored for the given target if they were
+        stored with the given probe, else None
+        """
+        entry = self.targets.get(key)
+        if entry is None or entry['probe'] != probe:
+            return None
+        return [(id, alter_hash.encode('utf-8'), ran_on) for (id, alter_hash, ran_on) in entry['history']]
+
+    def put(self, key, probe, history):
+        """
+        Store the history rows of the given target, along with the probe they
+        were read with
+        """
+        entry = {'probe': probe, 'history': history}
+        self.targets[key] = entry
+        self.updated[key] = entry
+
+    def save(self):
+        """
+        Write the updated entries back to disk, merged with what's on disk now
+        (another process may have updated other targets meanwhile). As for
+        ChainCache, the file is renamed into place and failures are ignored.
+        """
+        if not self.updated:
+            return
+
+        targets = self.__read()
+        targets.update(self.updated)
+        tmp_filename = '%s.%s.tmp' % (self.filename, os.getpid())
+        try:
+            cache_file = open(tmp_filename, 'w')
+            try:
+                json.dump({'version': self.VERSION, 'targets': targets}, cache_file)
+            finally:
+                cache_file.close()
+            os.rename(tmp_filename, self.filename)
+            self.updated = {}
+        except (IOError, OSError):
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def __read(self):
+        # A missing, unreadable or outdated cache is treated as empty
+        try:
+            cache_file = open(self.filename)
+            try:
+                data = json.load(cache_file)
+            finally:
+                cache_file.close()
+        except (IOError, OSError, ValueError):
+            return {}
+
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return {}
+        return data.get('targets', {})
+
+
+class StaticManifest(object):
+    """
+    Record of the static alter files written by 'gen-sql --sync', keyed by
+    filename. Each entry holds the stat key and content hash of the source
+    alter, and a fingerprint of everything else that goes into the static
+    file (options and revision query). A static file is only rewritten when
+    one of them changed: an unchanged stat key is trusted as is, otherwise
+    the content hash decides.
+    """
+    VERSION = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        """
+        Read the manifest from disk. A missing, unreadable or outdated
+        manifest is treated as empty (every static file is then rewritten).
+        """
+        try:
+            manifest_file = open(self.filename)
+            try:
+                data = json.load(manifest_file)
+            finally:
+                manifest_file.close()
+        except (IOError, OSError, ValueError):
+            return
+
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return
+        self.entries = data.get('files', {})
+
+    def get(self, filename):
+        """
+        Return the entry for the given file as a dict with 'stat', 'hash' and
+        'fingerprint' keys, or None
+        """
+        return self.entries.get(filename)
+
+    def put(self, filename, stat, hash, fingerprint):
+        """
+        Record the state of the source of the given static file
+        """
+        self.entries[filename] = {
+            'stat': self.stat_key(stat),
+            'hash': hash,
+            'fingerprint': fingerprint
+        }
+        self.dirty = True
+
+    def remove(self, filename):
+        del self.entries[filename]
+        self.dirty = True
+
+    def filenames(self):
+        return self.entries.keys()
+
+    def save(self):
+        """
+        Write the manifest back to disk if anything has changed, renaming it
+        into place. Failures are ignored: the static files are up to date, the
+        next sync will just do more work.
+        """
+        if not self.dirty:
+            return
+
+        tmp_filename = '%s.%s.tmp' % (self.filename, os.getpid())
+        try:
+            manifest_file = open(tmp_filename, 'w')
+            try:
+                json.dump({'version': self.VERSION, 'files': self.entries}, manifest_file)
+            finally:
+                manifest_file.close()
+            os.rename(tmp_filename, self.filename)
+            self.dirty = False
+        except (IOError, OSError):
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def stat_key(self, stat):
+        return [stat.st_mtime, stat.st_size, stat.st_ino]
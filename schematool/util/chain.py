@@ -1,14 +1,31 @@
 from itertools import islice
+from multiprocessing.pool import ThreadPool
 import os
 
+from cache import ChainCache, TailCache
 from constants import Constants
 from errors import CircularRefError, DuplicateRefsError, HeadError, MissingRefError, ReadError
 from metadata import MetaDataUtil
 from node import SimpleNode
 
 class ChainUtil(object):
+    cache_file = None
+    tail_cache_file = None
+    jobs = 1
+
     @classmethod
-    def build_chain(cls):
+    def configure(cls, config):
+        """
+        Setup chain-building options from the config: the on-disk meta-data
+        cache ('chain_cache'), the record of the last alter ('tail_cache')
+        and the number of threads used to read alter files ('chain_jobs').
+        """
+        cls.cache_file = config.get('chain_cache')
+        cls.tail_cache_file = config.get('tail_cache')
+        cls.jobs = int(config.get('chain_jobs', 1))
+
+    @classmethod
+    def build_chain(cls, jobs=None):
         """
         Walk the schemas directory and build the chain of alterations that should be run. Also
         return a list of "out-of-chain" items that don't quite fit.
@@ -17,7 +34,7 @@ class ChainUtil(object):
         :rtype : SimpleNode
         """
         files     = cls.get_alter_files()
-        nodes     = cls.build_soft_chain(files)
+        nodes     = cls.build_soft_chain(files, jobs)
         list_tail = cls.__build_and_validate_linked_list(nodes)
 
         # some debug statements
@@ -27,39 +44,94 @@ class ChainUtil(object):
         return list_tail
 
 
+    @classmethod
+    def get_tail(cls, jobs=None):
+        """
+        Return the last alter of the chain (or None if there are no alters).
+        If a tail cache is configured and the alter directory is unchanged
+        since it was written, the node is taken from the cache (in which case
+        it is not linked to its backref). Otherwise the chain is built, and
+        validated, as usual.
+
+        :rtype : SimpleNode
+        """
+        cache = cls.__load_tail_cache()
+        if cache is not None:
+            tail = cache.get(cls.__alter_dir_key())
+            if tail is not None:
+                (id, filename) = tail
+                if id is None:
+                    return None
+                return SimpleNode(id=id, filename=filename)
+
+        tail = cls.build_chain(jobs)
+        cls.set_tail(tail)
+        return tail
+
+    @classmethod
+    def set_tail(cls, tail):
+        """
+        Record the given node as the last alter of the chain in the tail cache
+        (if configured). Should be called whenever the tail changes.
+        """
+        cache = cls.__load_tail_cache()
+        if cache is None:
+            return
+        if tail is None:
+            cache.put(cls.__alter_dir_key(), None, None)
+        else:
+            cache.put(cls.__alter_dir_key(), tail.id, tail.filename)
+
     @classmethod
     def get_alter_files(cls):
-        files = os.walk(Constants.ALTER_DIR).next()[2]
+        # os.listdir rather than os.walk, which would stat every entry to
+        # separate files from directories
+        files = os.listdir(Constants.ALTER_DIR)
         return [f for f in files if Constants.FILENAME_STANDARD.search(f) is not None]
 
 
     @classmethod
-    def build_soft_chain(cls, files):
+    def build_soft_chain(cls, files, jobs=None):
         """
         Build a list of nodes "soft" linked. This means that each has an id
         (an integer value) and possibly a backref which is also an integer.
         Not a truly "linked" list
 
+        If jobs is greater than one, the alter files are read by a pool of
+        that many threads. The resulting list is the same either way.
+
         Returns an array of SimpleNodes
         :rtype : list
         """
-        nodes = []
+        files = [f for f in files if Constants.FILENAME_STANDARD.search(f)]
+        cache = cls.__load_cache()
 
-        for f in files:
-            if not Constants.FILENAME_STANDARD.search(f):
-                continue
+        # (direction, meta-data) for each file, taken from the cache when possible
+        heads = [None] * len(files)
+        stats = [None] * len(files)
+        to_read = []
+        for (i, f) in enumerate(files):
+            if cache is not None:
+                filename = os.path.join(Constants.ALTER_DIR, f)
+                try:
+                    stats[i] = os.stat(filename)
+                except OSError, ex:
+                    raise ReadError("Could not open file '%s'.\n\t=>%s" % (filename, ex.strerror))
+                heads[i] = cache.get(f, stats[i])
+            if heads[i] is None:
+                to_read.append(i)
 
-            try:
-                my_file = open(os.path.join(Constants.ALTER_DIR, f))
-                head = list(islice(my_file, 4))
-            except OSError, ex:
-                raise ReadError("Could not open file '%s'.\n\t=>%s" % (os.path.join(Constants.ALTER_DIR, f), ex.message))
+        read_heads = cls.__map(cls.__read_head, [files[i] for i in to_read], jobs)
+        for (i, head) in zip(to_read, read_heads):
+            heads[i] = head
+            if cache is not None:
+                cache.put(files[i], stats[i], head[0], head[1])
 
-            if not MetaDataUtil.parse_direction(head) == 'up':
+        nodes = []
+        for (f, (direction, meta_data)) in zip(files, heads):
+            if not direction == 'up':
                 continue
 
-            meta_data = MetaDataUtil.parse_meta(head)
-
             if 'ref' not in meta_data:
                 continue
 
@@ -77,8 +149,76 @@ class ChainUtil(object):
 
             nodes.append(node)
 
+        if cache is not None:
+            cache.prune(files)
+            cache.save()
+
         return nodes
 
+    @classmethod
+    def __load_tail_cache(cls):
+        """
+        Return the tail cache if one is configured, else None
+        """
+        if not cls.tail_cache_file:
+            return None
+        return TailCache(os.path.join(Constants.ALTER_DIR, cls.tail_cache_file))
+
+    @classmethod
+    def __alter_dir_key(cls):
+        """
+        Return a cheap signature of the alter directory (its mtime and the
+        number of alter files in it), used to validate the tail cache
+        """
+        return [os.stat(Constants.ALTER_DIR).st_mtime, len(cls.get_alter_files())]
+
+    @classmethod
+    def __read_head(cls, f):
+        """
+        Read the head of an alter file and return a 2-tuple of its direction
+        and meta-data (the meta-data is only parsed for up-alters)
+        """
+        filename = os.path.join(Constants.ALTER_DIR, f)
+        try:
+            my_file = open(filename)
+            try:
+                head = list(islice(my_file, 4))
+            finally:
+                my_file.close()
+        except (IOError, OSError), ex:
+            raise ReadError("Could not open file '%s'.\n\t=>%s" % (filename, ex.strerror))
+
+        (direction, meta_data) = MetaDataUtil.parse_head(head)
+        if not direction == 'up':
+            meta_data = {}
+        return (direction, meta_data)
+
+    @classmethod
+    def __map(cls, func, items, jobs=None):
+        """
+        Map func over items, using a thread pool of the given size (or the
+        configured default) when it is worth it. Order is preserved.
+        """
+        jobs = int(jobs or cls.jobs or 1)
+        if jobs <= 1 or len(items) <= 1:
+            return [func(i) for i in items]
+
+        pool = ThreadPool(min(jobs, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    @classmethod
+    def __load_cache(cls):
+        """
+        Return the meta-data cache if one is configured, else None
+        """
+        if not cls.cache_file:
+            return None
+        return ChainCache(os.path.join(Constants.ALTER_DIR, cls.cache_file))
+
 
     @classmethod
     def __build_and_validate_linked_list(cls, nodes):
@@ -94,12 +234,20 @@ class ChainUtil(object):
         if len(nodes) == 0:
             return None
 
+        # index nodes by id so that backrefs can be resolved without re-scanning
+        # the entire list for every node
+        nodes_by_id = {}
+        for node in nodes:
+            if node.id not in nodes_by_id:
+                nodes_by_id[node.id] = []
+            nodes_by_id[node.id].append(node)
+
         heads = []
         backrefs = {}
         for node in nodes:
             if node.backref is not None:
                 # Check for duplicate refs
-                backnodes = [n for n in nodes if n.id == node.backref]
+                backnodes = nodes_by_id.get(node.backref, [])
                 if len(backnodes) == 1:
                     node.backref = backnodes[0]
                 elif len(backnodes) > 1:
@@ -137,14 +285,9 @@ class ChainUtil(object):
         elif len(heads) == 0:
             raise HeadError("No head found")
 
-        # check tail(s)
-        tails = []
-        for node in nodes:
-            if node.backref is None:
-                continue
-            children = [n for n in nodes if n.backref == node]
-            if len(children) == 0:
-                tails.append(node)
+        # check tail(s). The backref catalog doubles as the children index: any
+        # linked node that is nobody's parent is a tail.
+        tails = [n for n in nodes if n.backref is not None and n.id not in backrefs]
 
         if len(tails) > 1:
             msg = "\n".join(["Duplicate backref found in %s\n" % tail.filename for tail in tails])
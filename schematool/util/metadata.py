@@ -2,7 +2,48 @@ import re
 
 from constants import Constants
 
+# Patterns used while parsing the head of an alter. These are compiled once
+# here since every line of every alter file goes through them.
+DIRECTION_COMMENT_REGEX = re.compile('--\s*')
+DIRECTION_REGEX = re.compile('direction\s*:\s*(up|down)')
+META_LINE_REGEX = re.compile('^\s*--|^\s*$')
+META_COMMENT_REGEX = re.compile('\s*--\s*')
+META_KEY_VALUE_REGEX = re.compile('^([a-zA-Z0-9\-_]+\s*):(.*)$')
+
 class MetaDataUtil(object):
+    @classmethod
+    def parse_head(cls, head):
+        """
+        Given the head of an alter (an array of strings), parse out both the
+        direction and the meta-data in a single pass over the lines.
+
+        Returns a 2-tuple of the direction ('up', 'down' or None) and the dict
+        of meta-data, exactly as parse_direction and parse_meta would.
+        """
+        direction = None
+        meta = {}
+        in_meta = True
+        for line in head:
+            # Only comment lines can carry a direction or meta-data, so the
+            # (inlined) parsing below is skipped for everything else.
+            stripped = line.strip()
+            if stripped[0:2] == '--':
+                match = DIRECTION_REGEX.match(DIRECTION_COMMENT_REGEX.sub('', stripped))
+                if match is not None:
+                    direction = match.group(1)
+            elif in_meta and stripped:
+                in_meta = False
+
+            if in_meta:
+                match = META_KEY_VALUE_REGEX.match(META_COMMENT_REGEX.sub('', line))
+                if match:
+                    key = match.group(1).strip()
+                    value = match.group(2).strip()
+                    if key and value:
+                        meta[key] = value
+
+        return (direction, meta)
+
     @classmethod
     def parse_direction(cls, head):
         """
@@ -24,7 +65,7 @@ class MetaDataUtil(object):
         result = []
         for i in envlist_str.split(','):
             i_stripped = i.strip()
-            match = re.match(Constants.ENV_NAME_STANDARD, i_stripped)
+            match = Constants.ENV_NAME_STANDARD.match(i_stripped)
             if match is not None:
                 result.append(match.group(0))
             else:
@@ -43,19 +84,11 @@ class MetaDataUtil(object):
 
         if not line[0:2] == '--':
             return None
-        regex = re.compile('--\s*')
-        line = regex.sub('', line)
-
-        up_regex   = re.compile('direction\s*:\s*(up)')
-        down_regex = re.compile('direction\s*:\s*(down)')
-
-        up   = up_regex.match(line)
-        down = down_regex.match(line)
+        line = DIRECTION_COMMENT_REGEX.sub('', line)
 
-        if up is not None:
-            return up.groups()[0]
-        elif down is not None:
-            return down.groups()[0]
+        match = DIRECTION_REGEX.match(line)
+        if match is not None:
+            return match.group(1)
         else:
             return None
 
@@ -72,9 +105,8 @@ class MetaDataUtil(object):
         { "ref": 1234, "backref": 123, "env": "prod" }
         """
         meta = {}
-        valid_line = re.compile('^\s*--|^\s*$')
         for line in file_contents:
-            if valid_line.match(line) == None:
+            if META_LINE_REGEX.match(line) == None:
                 break
             key, value = cls.__parse_key(line)
             if key and value:
@@ -96,11 +128,9 @@ class MetaDataUtil(object):
         Returns a 2-tuple of the key-value pair. Note that whitespace is trimmed
         off of the beginning and end of keys and values
         """
-        comment_regex = re.compile('\s*--\s*')
-        line = comment_regex.sub('', line)
+        line = META_COMMENT_REGEX.sub('', line)
 
-        key_value_regex = re.compile('^([a-zA-Z0-9\-_]+\s*):(.*)$')
-        match = key_value_regex.match(line)
+        match = META_KEY_VALUE_REGEX.match(line)
 
         if match:
             key   = match.groups()[0].strip()
@@ -0,0 +1,164 @@
+from errors import MissingDownAlterError, MissingRefError, MultipleDownAltersError
+
+class Plan(object):
+    """
+    The outcome of reconciling the alter chain with the history of a DB:
+        common: alters at the start of the chain that match the history
+        undo: alters to run down, in order
+        apply: alters to run up, in order
+        missing: ids of history entries without an alter that are to be
+                 dropped from the history (down with force)
+        warnings: messages to show the user
+    """
+    def __init__(self):
+        self.common = []
+        self.undo = []
+        self.apply = []
+        self.missing = []
+        self.warnings = []
+
+
+class PlanUtil(object):
+    """
+    Works out what up and down have to do, without running anything. All
+    lookups are done through dicts and sets so that planning stays linear in
+    the size of the chain and history, however far they have diverged.
+    """
+    @classmethod
+    def plan_up(cls, tail, history, should_run, target=None, number=None, undo=True, force=False):
+        """
+        Plan bringing a DB up to date with the chain ending in the given tail.
+        Walk the history (an iterable ordered by id, as returned by
+        Db.get_commit_history) along the chain until the two diverge, undo the
+        rest of the history (if undo is set) and apply the alters from the
+        point of divergence onwards, up to and including the target ref or the
+        given number of alters. Alters for which should_run(alter) is False are
+        skipped.
+
+        Returns a Plan
+        """
+        plan = Plan()
+        chain = cls.__chain_list(tail)
+
+        # find the common history (alters that don't run in this env can't be
+        # part of the history and are passed over). Only the history from the
+        # point of divergence onwards is kept.
+        history = iter(history)
+        uncommon_history = []
+        pos = 0
+        for entry in history:
+            while pos < len(chain) and not should_run(chain[pos]):
+                pos += 1
+            if pos == len(chain) or chain[pos].id != entry[1]:
+                uncommon_history.append(entry)
+                uncommon_history.extend(history)
+                break
+            plan.common.append(chain[pos])
+            pos += 1
+        remaining = chain[pos:]
+
+        applied = set(a.id for a in plan.common)
+        applied.update(h[1] for h in uncommon_history)
+        if undo:
+            by_id = {}
+            for alter in reversed(remaining):
+                by_id.setdefault(alter.id, []).append(alter)
+
+            for (_, alter_id, _) in reversed(uncommon_history):
+                alters = by_id.get(alter_id, [])
+                if len(alters) > 1:
+                    msg = "Multiple alters found for a single id (%s)" % alter_id
+                    if not force:
+                        raise MultipleDownAltersError(msg)
+                    plan.warnings.append(msg + "\n")
+                elif len(alters) == 0:
+                    raise MissingDownAlterError("Missing down alter %s" % alter_id)
+                plan.undo.append(alters[0])
+                applied.discard(alter_id)
+
+        # Ensure that if a target ref was specified that one was found in
+        # in the list of alters to run (up)
+        if remaining and target is not None and target not in set(a.id for a in remaining):
+            raise MissingRefError('revision (%s) not found in alters that would be run' % target)
+
+        max_ = int(number or len(remaining))
+        i = 0
+        for alter in remaining:
+            if i == max_:
+                break
+            if target == alter.id:
+                i = (max_ - 1)
+            i += 1
+
+            if not should_run(alter):
+                continue
+            if alter.id not in applied:
+                plan.apply.append(alter)
+            else:
+                plan.warnings.append("Warning: alter %s has already been run. Skipping\n" % alter.id)
+
+        return plan
+
+    @classmethod
+    def plan_down(cls, tail, history, run_type=None, target=None, number=None, force=False):
+        """
+        Plan undoing alters from the end of the history of a DB, given as an
+        iterable ordered from the newest entry to the oldest (see
+        Db.get_commit_history). run_type is one of 'all', 'base' (all but the
+        first alter) or 'revision' (up to and including the target ref), or
+        None to undo the given number of alters. With force, history entries
+        that have no alter in the chain end up in Plan.missing instead of
+        raising an error.
+
+        Returns a Plan
+        """
+        plan = Plan()
+        by_id = {}
+        for alter in reversed(cls.__chain_list(tail)):
+            by_id.setdefault(alter.id, alter)
+        # with a number of alters, the history is read no further than needed
+        if number is None:
+            history = list(history)
+        max_history_len = int(number or len(history))
+        i = 0
+        try:
+            for (_, alter_id, _) in history:
+                if i == max_history_len:
+                    break
+                if run_type == 'base':
+                    if i == (max_history_len - 1):
+                        break
+                elif run_type != 'all' and target == alter_id:
+                    i = (max_history_len - 1)
+                i += 1
+
+                alter = by_id.get(alter_id)
+                if alter is not None:
+                    plan.undo.append(alter)
+                elif force:
+                    plan.missing.append(alter_id)
+                else:
+                    raise MissingDownAlterError("missing alter: %s\n" % alter_id)
+        finally:
+            if hasattr(history, 'close'):
+                history.close()
+
+        # ensure that if a target_revision was specified that one was found in
+        # in the list of alters to run (down)
+        if run_type == 'revision' and target not in set(a.id for a in plan.undo):
+            raise MissingRefError('revision (%s) not found in alters that would be run' % target)
+
+        return plan
+
+    @classmethod
+    def __chain_list(cls, tail):
+        """
+        Return the alters of the chain ending in the given tail, in the order
+        they are meant to be run
+        """
+        chain = []
+        while tail is not None:
+            chain.append(tail)
+            tail = tail.backref
+        chain.reverse()
+        return chain
@@ -0,0 +1,151 @@
+import re
+
+DELIMITER_REGEX = re.compile('[ \t]*delimiter[ \t]+(\S+)[ \t]*(?:\r?\n|$)', re.IGNORECASE)
+DOLLAR_QUOTE_REGEX = re.compile('\$([a-zA-Z_][a-zA-Z0-9_]*)?\$')
+
+class SqlUtil(object):
+    @classmethod
+    def split_statements(cls, sql, dialect='mysql'):
+        """
+        Split the contents of an alter file into the individual statements that
+        a command line client would send to the server. Quoted strings,
+        identifiers and comments are respected and line comments are dropped.
+        For MySQL the client-side DELIMITER command and '#' comments are
+        supported. For Postgres, dollar-quoted bodies ($$ ... $$) and nested
+        block comments are kept intact.
+
+        Returns a list of statements (strings) without their delimiters
+        """
+        mysql = (dialect == 'mysql')
+        quotes = '\'"`' if mysql else '\'"'
+
+        statements = []
+        statement = _StatementBuffer()
+        delimiter = ';'
+        special = cls.__special_regex(delimiter, mysql)
+        i = 0
+        n = len(sql)
+        while i < n:
+            # DELIMITER is a client command, only recognized at the start of a
+            # line when no statement is pending
+            if mysql and not statement.pending and (i == 0 or sql[i - 1] == '\n'):
+                directive = DELIMITER_REGEX.match(sql, i)
+                if directive is not None:
+                    delimiter = directive.group(1)
+                    special = cls.__special_regex(delimiter, mysql)
+                    i = directive.end()
+                    continue
+
+            # copy everything up to the next character that might matter
+            match = special.search(sql, i)
+            if match is None:
+                statement.append(sql[i:])
+                break
+            if match.start() > i:
+                statement.append(sql[i:match.start()])
+                i = match.start()
+
+            c = sql[i]
+            if sql.startswith(delimiter, i):
+                statement.flush(statements)
+                i += len(delimiter)
+            elif sql.startswith('--', i) and (not mysql or i + 2 == n or sql[i + 2].isspace()):
+                i = cls.__end_of_line(sql, i)
+            elif mysql and c == '#':
+                i = cls.__end_of_line(sql, i)
+            elif sql.startswith('/*', i):
+                end = cls.__end_of_block_comment(sql, i, nested=not mysql)
+                # MySQL's executable comments and hints are meant for the server
+                if not mysql or sql[i + 2:i + 3] in ('!', '+'):
+                    statement.append(sql[i:end])
+                i = end
+            elif c in quotes:
+                # Postgres only honors backslash escapes in E'...' strings
+                escapes = mysql or (c == "'" and i > 0 and sql[i - 1] in 'eE')
+                end = cls.__end_of_quote(sql, i, backslash_escapes=escapes)
+                statement.append(sql[i:end])
+                i = end
+            elif c == '$' and not mysql:
+                tag = DOLLAR_QUOTE_REGEX.match(sql, i)
+                if tag is not None and not (i > 0 and (sql[i - 1].isalnum() or sql[i - 1] == '_')):
+                    end = sql.find(tag.group(0), tag.end())
+                    end = n if end == -1 else end + len(tag.group(0))
+                else:
+                    end = i + 1
+                statement.append(sql[i:end])
+                i = end
+            else:
+                statement.append(c)
+                i += 1
+
+        statement.flush(statements)
+        return statements
+
+    @classmethod
+    def __special_regex(cls, delimiter, mysql):
+        chars = '\'"/$-' + delimiter[0]
+        if mysql:
+            chars += '`#\n'
+        return re.compile('[%s]' % re.escape(chars))
+
+    @classmethod
+    def __end_of_line(cls, sql, i):
+        end = sql.find('\n', i)
+        return len(sql) if end == -1 else end
+
+    @classmethod
+    def __end_of_block_comment(cls, sql, i, nested=False):
+        depth = 0
+        n = len(sql)
+        while i < n:
+            if sql.startswith('/*', i):
+                depth += 1
+                i += 2
+            elif sql.startswith('*/', i):
+                depth -= 1
+                i += 2
+                if depth == 0 or not nested:
+                    return i
+            else:
+                i += 1
+        return n
+
+    @classmethod
+    def __end_of_quote(cls, sql, i, backslash_escapes=False):
+        quote = sql[i]
+        n = len(sql)
+        i += 1
+        while i < n:
+            c = sql[i]
+            if backslash_escapes and c == '\\':
+                i += 2
+            elif c == quote:
+                if sql[i + 1:i + 2] == quote:
+                    i += 2
+                else:
+                    return i + 1
+            else:
+                i += 1
+        return n
+
+
+class _StatementBuffer(object):
+    """
+    Collects the pieces of the statement being split, keeping track of
+    whether anything other than whitespace has been seen
+    """
+    def __init__(self):
+        self.parts = []
+        self.pending = False
+
+    def append(self, text):
+        self.parts.append(text)
+        if not self.pending and text.strip():
+            self.pending = True
+
+    def flush(self, statements):
+        statement = ''.join(self.parts).strip()
+        if statement:
+            statements.append(statement)
+        self.parts = []
+        self.pending = False
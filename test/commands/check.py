@@ -8,8 +8,9 @@ import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../s
 sys.path.append(import_path)
 from command import DownCommand, CommandContext, NewCommand
 from command import UpCommand, CheckCommand
-from errors import MissingDownAlterError, MissingUpAlterError
-from util import ChainUtil
+from errors import DuplicateRefsError, MissingDownAlterError, MissingRefError, MissingUpAlterError
+from node import ChainArray, SimpleNode
+from util import ChainUtil, MetaDataUtil
 
 # test util imports
 import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../util')
@@ -58,7 +59,93 @@ class CheckTest(unittest.TestCase):
     def test_missing_down_alter(self):
         return self.help_test_missing_alter('-down', MissingDownAlterError)
 
+    def test_divergent_chain(self):
+        id1, _ = AlterUtil.create_alters([1, 2])
+        for direction in ['up', 'down']:
+            alter_file = open(os.path.join(EnvironmentUtil.get_alter_dir(),
+                                           '999999999999-branch-%s.sql' % direction), 'w')
+            alter_file.write("-- direction: %s\n-- backref: %s\n-- ref: 999999999999\n" % (direction, id1))
+            alter_file.close()
 
+        sys.argv = make_argv([])
+        self.assertRaises(DuplicateRefsError, self.checkCommand.run)
+
+    def test_chain_same_with_jobs(self):
+        AlterUtil.create_alters([1, 2, 3, 4, 5])
+        def walk(tail):
+            nodes = []
+            while tail is not None:
+                nodes.append((tail.id, tail.filename, tail.meta))
+                tail = tail.backref
+            return nodes
+        serial = walk(ChainUtil.build_chain(jobs=1))
+        self.assertEqual(len(serial), 5)
+        self.assertEqual(walk(ChainUtil.build_chain(jobs=4)), serial)
+
+        sys.argv = make_argv(['-j', '4'])
+        self.checkCommand.run()
+
+    def test_parse_head_matches_separate_parsers(self):
+        heads = [
+            # direction after a non-comment line: still found, meta stops there
+            ['-- ref: 1\n', 'SELECT 1;\n', '-- direction: up\n', '-- backref: 0\n'],
+            # '--' with no space after it
+            ['--direction:down\n', '--ref:2\n', '--backref:1\n'],
+            # trailing whitespace
+            ['-- direction: up   \n', '-- ref: 3 \t\n', '  \n', '-- backref:   2  \n'],
+            # stray '--', empty values and keys
+            ['--\n', '-- ref:\n', '-- : x\n', '-- direction : up\n'],
+            [],
+        ]
+        expected = [
+            ('up', {'ref': '1'}),
+            ('down', {'direction': 'down', 'ref': '2', 'backref': '1'}),
+            ('up', {'direction': 'up', 'ref': '3', 'backref': '2'}),
+            ('up', {'direction': 'up'}),
+            (None, {}),
+        ]
+        for (head, result) in zip(heads, expected):
+            self.assertEqual(MetaDataUtil.parse_head(head), result)
+            self.assertEqual(MetaDataUtil.parse_head(head),
+                             (MetaDataUtil.parse_direction(head), MetaDataUtil.parse_meta(head)))
+
+    def test_chain_array(self):
+        ids = AlterUtil.create_alters([1, 2, 3])
+        tail = ChainUtil.build_chain()
+        chain = ChainArray(tail)
+        self.assertEqual(len(chain), 3)
+        self.assertEqual(chain.ids, ids)
+        self.assertEqual(list(chain.backrefs), [-1, 0, 1])
+        self.assertEqual(chain.nodes[-1], tail)
+        for (i, id) in enumerate(ids):
+            self.assertEqual(chain.index(id), i)
+            self.assertEqual(chain.find(id).id, id)
+            self.assertEqual(chain.filenames[i], chain.nodes[i].filename)
+            # the backref indexes agree with the linked nodes
+            if chain.backrefs[i] == -1:
+                self.assertEqual(chain.nodes[i].backref, None)
+            else:
+                self.assertEqual(chain.nodes[i].backref, chain.nodes[chain.backrefs[i]])
+        self.assertEqual(chain.index('000000000000'), -1)
+        self.assertEqual(chain.find('000000000000'), None)
+        self.assertEqual(len(ChainArray(None)), 0)
+
+    def test_node_slots(self):
+        node = SimpleNode(id='1', filename='000000000001-name-up.sql')
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertRaises(AttributeError, setattr, node, 'other', 1)
+        self.assertEqual((node.require_env, node.skip_env, node.is_applied), (None, None, None))
+        self.assertEqual(node.down_filename(), '000000000001-name-down.sql')
+
+    def test_abandoned_alter(self):
+        AlterUtil.create_alters([1])
+        # an up-alter without a ref is not part of the chain
+        for direction in ('up', 'down'):
+            f = open('000000000001-abandoned-%s.sql' % direction, 'w')
+            f.write('-- direction: %s\n\nSELECT 1;\n' % direction)
+            f.close()
+        sys.argv = make_argv([])
+        self.assertRaises(MissingRefError, self.checkCommand.run)
 
 
 if __name__ == '__main__':
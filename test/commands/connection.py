@@ -0,0 +1,125 @@
+# stdlib imports
+import os
+import sys
+import unittest
+from time import time
+
+# src imports
+import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../schematool')
+sys.path.append(import_path)
+from db import ConnectionPool, PostgresDb
+
+class StubConnection(object):
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def check(conn):
+    return conn.alive
+
+class ConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        ConnectionPool.reset()
+        self.pg_config = {
+          'type': 'postgres',
+          'host': 'localhost',
+          'username': 'root',
+          'revision_db_name': 'revision',
+          'revision_schema_name': 'revision',
+          'history_table_name': 'history'}
+
+    def tearDown(self):
+        ConnectionPool.reset()
+
+    def test_pool_reuses_released_connection(self):
+        conn = ConnectionPool.acquire('a', StubConnection, check)
+        ConnectionPool.release('a', conn)
+        self.assertTrue(ConnectionPool.acquire('a', StubConnection, check) is conn)
+        # handed out, so no longer idle
+        self.assertFalse(ConnectionPool.acquire('a', StubConnection, check) is conn)
+        self.assertFalse(conn.closed)
+
+    def test_pool_closes_connections_beyond_max_size(self):
+        ConnectionPool.configure({'pool_size': 2})
+        conns = [ConnectionPool.acquire('a', StubConnection) for _ in range(3)]
+        for conn in conns:
+            ConnectionPool.release('a', conn)
+        self.assertEqual([conn.closed for conn in conns], [False, False, True])
+        self.assertEqual(len(ConnectionPool.idle['a']), 2)
+
+        ConnectionPool.configure({'pool_size': 0})
+        conn = ConnectionPool.acquire('b', StubConnection)
+        ConnectionPool.release('b', conn)
+        self.assertTrue(conn.closed)
+
+    def test_pool_evicts_dead_connections(self):
+        dead = StubConnection()
+        ConnectionPool.release('a', dead)
+        dead.alive = False
+        conn = ConnectionPool.acquire('a', StubConnection, check)
+        self.assertFalse(conn is dead)
+        self.assertTrue(dead.closed)
+        self.assertFalse(conn.closed)
+
+    def test_pool_evicts_stale_connections(self):
+        ConnectionPool.configure({'pool_idle_timeout': 60})
+        stale = StubConnection()
+        ConnectionPool.release('a', stale)
+        ConnectionPool.idle['a'] = [(stale, time() - 61)]
+        fresh = StubConnection()
+        ConnectionPool.release('b', fresh)
+
+        conn = ConnectionPool.acquire('a', StubConnection, check)
+        self.assertFalse(conn is stale)
+        self.assertTrue(stale.closed)
+        self.assertFalse(fresh.closed)
+        self.assertEqual(ConnectionPool.idle.keys(), ['b'])
+
+    def test_pool_keys_are_separate(self):
+        conn = ConnectionPool.acquire('a', StubConnection)
+        ConnectionPool.release('a', conn)
+        self.assertFalse(ConnectionPool.acquire('b', StubConnection) is conn)
+        self.assertTrue(ConnectionPool.acquire('a', StubConnection) is conn)
+
+    def test_pool_reset(self):
+        ConnectionPool.configure({'pool_size': 5, 'pool_idle_timeout': 1})
+        conn = StubConnection()
+        ConnectionPool.release('a', conn)
+        ConnectionPool.reset()
+        self.assertEqual(ConnectionPool.idle, {})
+        self.assertEqual((ConnectionPool.max_size, ConnectionPool.idle_timeout), (1, 300))
+        # forgotten rather than closed
+        self.assertFalse(conn.closed)
+
+    def test_pg_conn_string(self):
+        db = PostgresDb(self.pg_config)
+        self.assertEqual(db.conn_string(),
+                         "host='localhost' user='root' dbname='revision'")
+        self.assertEqual(db.conn_string(db_name='app'),
+                         "host='localhost' user='root' dbname='app'")
+
+    def test_pg_conn_string_quotes_values(self):
+        self.pg_config['password'] = "it's a secret\\"
+        db = PostgresDb(self.pg_config)
+        self.assertTrue("password='it\\'s a secret\\\\'" in db.conn_string())
+
+    def test_pg_conn_string_search_path(self):
+        db = PostgresDb(self.pg_config)
+        self.assertTrue(db.conn_string(search_path='app').endswith(
+            " options='-c search_path=app'"))
+        # whitespace after the commas is dropped
+        self.assertTrue(db.conn_string(search_path='app, public').endswith(
+            " options='-c search_path=app,public'"))
+        # spaces left within a schema name are escaped for the options, and
+        # backslashes once more for the connection string
+        self.assertTrue(db.conn_string(search_path='"my app",public').endswith(
+            " options='-c search_path=\"my\\\\ app\",public'"))
+
+
+if __name__ == '__main__':
+    unittest.main()
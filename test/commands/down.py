@@ -1,5 +1,6 @@
 # stdlib imports
 import os
+import random
 import sys
 import unittest
 
@@ -8,7 +9,9 @@ import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../s
 sys.path.append(import_path)
 from command import CommandContext, DownCommand
 from db import MemoryDb
-from errors import MissingRefError
+from errors import MissingDownAlterError, MissingRefError
+from node import SimpleNode
+from util import PlanUtil
 
 # test util imports
 import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../util')
@@ -17,6 +20,49 @@ from alter_util import AlterUtil
 from env_util import EnvironmentUtil
 from test_util import make_argv
 
+def reference_plan_down(tail, history, run_type, target_rev, number, force):
+    """
+    The reconciliation DownCommand did before PlanUtil, recording the alters
+    it would run instead of running them
+    """
+    undone, missing = [], []
+    history = sorted(history, key=lambda h: h[0], reverse=True)
+    alter_list = [tail]
+    if None in alter_list:
+        alter_list.remove(None)
+    while tail is not None and tail.backref is not None:
+        tail = tail.backref
+        alter_list.append(tail)
+
+    max_history_len = int(number or len(history))
+    i = 0
+    for (_, alter_id, _) in history:
+        if i == max_history_len:
+            break
+        if run_type == 'base':
+            if i == (max_history_len - 1):
+                break
+        elif run_type == 'all':
+            pass
+        else:
+            if target_rev == alter_id:
+                i = (max_history_len - 1)
+
+        i += 1
+        alters = [a for a in alter_list if a.id == alter_id]
+        if len(alters) > 0:
+            undone.append(alters[0].id)
+        elif force:
+            missing.append(alter_id)
+        else:
+            raise MissingDownAlterError("missing alter: %s\n" % alter_id)
+
+    if run_type == 'revision' and target_rev not in undone:
+        raise MissingRefError('revision (%s) not found in alters that would be run' % target_rev)
+
+    return (undone, missing)
+
+
 class DownTest(unittest.TestCase):
 
     def setUp(self):
@@ -104,6 +150,44 @@ class DownTest(unittest.TestCase):
 
         self.assertEqual(len(MemoryDb.data), 2)
 
+    def test_plan_matches_reference_on_random_chains(self):
+        rand = random.Random(1234)
+        for _ in range(500):
+            tail = None
+            for i in range(rand.randint(0, 30)):
+                node = SimpleNode(id='%04d' % i, filename='%04d-up.sql' % i)
+                node.backref = tail
+                tail = node
+            chain = []
+            node = tail
+            while node is not None:
+                chain.insert(0, node)
+                node = node.backref
+
+            ids = rand.sample([a.id for a in chain], rand.randint(0, len(chain)))
+            if rand.random() < 0.2:
+                ids.insert(rand.randint(0, len(ids)), 'missing')
+            history = [(n + 1, id, None) for (n, id) in enumerate(ids)]
+            rand.shuffle(history)
+
+            run_type = rand.choice([None, 'all', 'base', 'revision'])
+            target_rev = None
+            if run_type == 'revision':
+                target_rev = rand.choice(['missing', 'unknown'] + ids)
+            number = rand.choice([None, rand.randint(1, 10)]) if run_type is not None else rand.randint(1, 10)
+            force = rand.random() < 0.5
+
+            try:
+                expected = reference_plan_down(tail, history, run_type, target_rev, number, force)
+            except Exception, ex:
+                expected = type(ex)
+            try:
+                plan = PlanUtil.plan_down(tail, iter(sorted(history, reverse=True)), run_type, target_rev, number, force)
+                actual = ([a.id for a in plan.undo], plan.missing)
+            except Exception, ex:
+                actual = type(ex)
+            self.assertEqual(expected, actual)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,90 @@
+# stdlib imports
+import json
+import os
+import sys
+import unittest
+
+# src imports
+import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../schematool')
+sys.path.append(import_path)
+from command import FleetRunner
+from errors import ConfigFileError, FleetError
+
+# test util imports
+import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../util')
+sys.path.append(import_path)
+from alter_util import AlterUtil
+from env_util import EnvironmentUtil
+from test_util import make_argv
+
+class FleetTest(unittest.TestCase):
+
+    def setUp(self):
+        EnvironmentUtil.setup_fresh_test_env()
+        self.config = {
+          'type': 'memory-db',
+          'fleet': [{'name': 'one'}, {'name': 'two'}, {'name': 'three'}]}
+
+    def tearDown(self):
+        EnvironmentUtil.teardown_fresh_test_env()
+
+    def test_runs_command_on_every_target(self):
+        ids = AlterUtil.create_alters([1, 2])
+        results = FleetRunner(self.config).run('PlanCommand', make_argv([]), parallel=2)
+        self.assertEqual([r[0] for r in results], ['one', 'two', 'three'])
+        for (_, success, plan) in results:
+            self.assertTrue(success)
+            self.assertEqual([a['id'] for a in plan['apply']], ids)
+
+    def test_target_overrides_config(self):
+        AlterUtil.create_alters([1])
+        self.config['fleet'][1]['env'] = 'prod'
+        results = FleetRunner(self.config).run('ListCommand', make_argv([]), parallel=3)
+        self.assertTrue(all(success for (_, success, _) in results))
+
+    def test_failure_is_isolated(self):
+        AlterUtil.create_alters([1])
+        self.config['fleet'][1]['type'] = 'unknown'
+        try:
+            FleetRunner(self.config).run('UpCommand', make_argv([]), parallel=3)
+            self.fail('FleetError not raised')
+        except FleetError, ex:
+            message = ex.args[0]
+        self.assertTrue('failed on 1 target(s)' in message)
+        self.assertTrue('two:' in message)
+
+    def test_targets_with_same_derived_name(self):
+        AlterUtil.create_alters([1])
+        self.config['fleet'] = [{'host': 'h1'}, {'host': 'h1', 'type': 'unknown'}]
+        try:
+            FleetRunner(self.config).run('UpCommand', make_argv([]), parallel=2)
+            self.fail('FleetError not raised')
+        except FleetError, ex:
+            self.assertTrue('failed on 1 target(s)' in ex.args[0])
+
+    def test_duplicate_target_name(self):
+        self.config['fleet'].append({'name': 'two'})
+        self.assertRaises(ConfigFileError, FleetRunner, self.config)
+
+    def test_validate_target_configs(self):
+        config = {
+          'type': 'mysql',
+          'revision_db_name': 'revision',
+          'history_table_name': 'history',
+          'fleet': [{'name': 'a', 'host': 'h1'}, {'name': 'b'}]}
+        self.assertEqual(FleetRunner(config).validate_configs(), ["[b] Missing config value 'host'"])
+
+    def test_targets_from_file(self):
+        fleet_file = open('fleet.json', 'w')
+        json.dump([{'name': 'a', 'host': 'h1'}, {'host': 'h2', 'db_name': 'd2'}], fleet_file)
+        fleet_file.close()
+        targets = FleetRunner.load_targets('fleet.json')
+        self.assertEqual([name for (name, _) in targets], ['a', 'h2/d2'])
+
+    def test_invalid_fleet(self):
+        self.assertRaises(ConfigFileError, FleetRunner.load_targets, {'host': 'h1'})
+        self.assertRaises(ConfigFileError, FleetRunner.load_targets, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+# stdlib imports
+from StringIO import StringIO
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import unittest
+import zipfile
+
+# src imports
+import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../schematool')
+sys.path.append(import_path)
+from command import CommandContext, GenSqlCommand
+from errors import MissingRefError, OptionsError
+
+# test util imports
+import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../util')
+sys.path.append(import_path)
+from alter_util import AlterUtil
+from env_util import EnvironmentUtil
+from test_util import make_argv
+
+class GenSqlTest(unittest.TestCase):
+
+    def setUp(self):
+        EnvironmentUtil.setup_fresh_test_env()
+        self.context = CommandContext.via({
+          'type': 'memory-db',
+          'static_alter_dir': 'static'})
+        self.genSqlCommand = GenSqlCommand(self.context)
+
+    def tearDown(self):
+        EnvironmentUtil.teardown_fresh_test_env()
+
+    def gen_sql(self, argv):
+        sys.argv = make_argv(argv)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.genSqlCommand.run()
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def alter_sql(self, id, direction='up'):
+        filename = [f for f in os.listdir('.') if f.startswith(id) and f.endswith('-%s.sql' % direction)][0]
+        return open(filename).read()
+
+    def test_gen_sql(self):
+        id1, id2 = AlterUtil.create_alters([1, 2])
+        expected = (self.alter_sql(id1) + 'n/a for memory-db;\n\n' +
+                    self.alter_sql(id2) + 'n/a for memory-db;').rstrip() + '\n'
+        self.assertEqual(self.gen_sql([]), expected)
+
+    def test_gen_sql_single_ref(self):
+        id1, id2 = AlterUtil.create_alters([1, 2])
+        expected = (self.alter_sql(id2, 'down') +
+                    '\n\n-- start rev query\nn/a for memory-db;\n-- end rev query\n').rstrip() + '\n'
+        self.assertEqual(self.gen_sql(['-d', '-q', id2]), expected)
+
+    def test_trailing_whitespace_trimmed(self):
+        AlterUtil.create_alters([1, 2])
+        self.assertEqual(self.gen_sql(['-S', '-R']), '\n')
+
+    def test_write_to_file(self):
+        id1, id2 = AlterUtil.create_alters([1, 2])
+        output = self.gen_sql(['-w'])
+        filenames = sorted(os.listdir('static'))
+        self.assertEqual(output.splitlines(), [os.path.join('static', f) for f in filenames])
+        self.assertEqual(len(filenames), 2)
+        self.assertEqual(open(os.path.join('static', filenames[0])).read(), self.gen_sql(['-q', id1]))
+
+    def test_write_to_file_in_parallel(self):
+        AlterUtil.create_alters([1, 2, 3, 4])
+        serial_output = self.gen_sql(['-w', '-d'])
+        serial = dict((f, open(os.path.join('static', f)).read()) for f in os.listdir('static'))
+        for f in os.listdir('static'):
+            os.remove(os.path.join('static', f))
+
+        self.assertEqual(self.gen_sql(['-w', '-d', '-j', '3']), serial_output)
+        parallel = dict((f, open(os.path.join('static', f)).read()) for f in os.listdir('static'))
+        self.assertEqual(parallel, serial)
+
+    def test_write_to_file_duplicate_refs(self):
+        id1, id2 = AlterUtil.create_alters([1, 2])
+        output = self.gen_sql(['-w', '-j', '2', id2, id1, id2])
+        self.assertEqual(output.splitlines(), [os.path.join('static', f) for f in reversed(sorted(os.listdir('static')))])
+        self.assertEqual(len(os.listdir('static')), 2)
+        static_filename = os.path.join('static', os.listdir('static')[0])
+        # files get the usual permissions, not the private ones of a temporary file
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(static_filename).st_mode & 0777, 0666 & ~umask)
+
+    def test_sync(self):
+        id1, id2 = AlterUtil.create_alters([1, 2])
+        sys.argv = make_argv(['--sync'])
+        (written, removed) = self.genSqlCommand.run()
+        self.assertEqual(len(written), 4)
+        self.assertEqual(sorted(os.listdir('static')), sorted(os.path.basename(f) for f in written))
+        self.assertEqual(open(written[0]).read(), self.gen_sql(['-q', id1]))
+
+        # nothing changed
+        sys.argv = make_argv(['--sync'])
+        self.assertEqual(self.genSqlCommand.run(), ([], []))
+
+        # only rewritten if the content changed
+        up_file = [f for f in os.listdir('.') if f.startswith(id1) and f.endswith('-up.sql')][0]
+        os.utime(up_file, None)
+        sys.argv = make_argv(['--sync'])
+        self.assertEqual(self.genSqlCommand.run(), ([], []))
+        with open(up_file, 'a') as f:
+            f.write('SELECT 1;\n')
+        sys.argv = make_argv(['--sync'])
+        self.assertEqual(self.genSqlCommand.run(), ([os.path.join('static', up_file)], []))
+
+        # static files of removed alters are removed
+        for f in os.listdir('.'):
+            if f.startswith(id2):
+                os.remove(f)
+        sys.argv = make_argv(['--sync'])
+        (written, removed) = self.genSqlCommand.run()
+        self.assertEqual(written, [])
+        self.assertEqual(len(removed), 2)
+        self.assertEqual(len(os.listdir('static')), 2)
+
+    def test_sync_keeps_foreign_files(self):
+        AlterUtil.create_alters([1])
+        os.mkdir('static')
+        for f in ('000000000000-by-hand-up.sql', 'report.sql'):
+            open(os.path.join('static', f), 'w').close()
+        sys.argv = make_argv(['--sync'])
+        (written, removed) = self.genSqlCommand.run()
+        self.assertEqual(len(written), 2)
+        self.assertEqual(removed, [])
+        self.assertEqual(len(os.listdir('static')), 4)
+
+    def test_sync_takes_no_refs(self):
+        id1, = AlterUtil.create_alters([1])
+        sys.argv = make_argv(['--sync', id1])
+        self.assertRaises(OptionsError, self.genSqlCommand.run)
+
+    def test_staged(self):
+        id1, id2, id3 = AlterUtil.create_alters([1, 2, 3])
+        self.gen_sql(['-w', id1])
+        subprocess.check_call(['git', 'init', '-q'])
+        staged = [f for f in os.listdir('.') if f.startswith(id2)] + ['static']
+        subprocess.check_call(['git', 'add'] + staged)
+
+        sys.argv = make_argv(['--staged'])
+        written = self.genSqlCommand.run()
+        self.assertEqual(sorted(os.path.basename(f) for f in written),
+                         sorted(f for f in staged if f != 'static'))
+        self.assertEqual(open(written[1]).read(), self.gen_sql(['-q', '-d', id2]))
+
+    def test_bundle(self):
+        id1, id2, id3 = AlterUtil.create_alters([1, 2, 3])
+        sys.argv = make_argv(['--bundle', 'out.tar.gz', id3, id1])
+        manifest = self.genSqlCommand.run()
+        self.assertEqual([a['ref'] for a in manifest['alters']], [id1, id3])
+        self.assertEqual(manifest['alters'][1]['backref'], id2)
+
+        archive = tarfile.open('out.tar.gz')
+        self.assertEqual(json.loads(archive.extractfile('manifest.json').read()), manifest)
+        for alter in manifest['alters']:
+            for direction in ('up', 'down'):
+                content = archive.extractfile(alter[direction]['file']).read()
+                self.assertEqual(hashlib.sha256(content).hexdigest(), alter[direction]['sha256'])
+                argv = ['-q', alter['ref']] + (['-d'] if direction == 'down' else [])
+                self.assertEqual(content, self.gen_sql(argv))
+        self.assertEqual(len(archive.getnames()), 5)
+
+    def test_bundle_zip(self):
+        AlterUtil.create_alters([1, 2])
+        sys.argv = make_argv(['-b', 'out.zip'])
+        manifest = self.genSqlCommand.run()
+        names = zipfile.ZipFile('out.zip').namelist()
+        self.assertEqual(len(names), 5)
+        self.assertEqual(set(names), set(['manifest.json'] + [a[d]['file'] for a in manifest['alters']
+                                                              for d in ('up', 'down')]))
+
+    def test_bundle_format(self):
+        AlterUtil.create_alters([1])
+        sys.argv = make_argv(['-b', 'out.rar'])
+        self.assertRaises(OptionsError, self.genSqlCommand.run)
+
+    def test_missing_ref(self):
+        AlterUtil.create_alters([1])
+        self.assertRaises(MissingRefError, self.gen_sql, ['000000000000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
 # stdlib imports
+from StringIO import StringIO
+import json
 import os
 import sys
 import unittest
@@ -7,6 +9,8 @@ import unittest
 import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../schematool')
 sys.path.append(import_path)
 from command import CommandContext, ListCommand
+from db import MemoryDb
+from errors import MissingRefError, OptionsError
 
 # test util imports
 import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../util')
@@ -40,6 +44,124 @@ class ListTest(unittest.TestCase):
         result = self.listCommand.run()
         self.assertEqual([id2, id1], result)
 
+    def test_applied_flag(self):
+        id1, id2, id3 = AlterUtil.create_alters([1, 2, 3])
+        AlterUtil.run_alters()
+        self.context.db.remove_commit(id2)
+        sys.argv = make_argv([])
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.listCommand.run()
+            lines = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual([line[3] for line in lines], ['*', ' ', '*'])
+        self.assertTrue(id2 in lines[1])
+
+    def test_limit_and_offset(self):
+        ids = AlterUtil.create_alters([1, 2, 3, 4, 5])
+        sys.argv = make_argv(['--offset', '1', '--limit', '2'])
+        self.assertEqual(ids[1:3], self.listCommand.run())
+        sys.argv = make_argv(['-r', '--limit', '2'])
+        self.assertEqual([ids[4], ids[3]], self.listCommand.run())
+        sys.argv = make_argv(['--offset', '4', '--limit', '5'])
+        self.assertEqual(ids[4:], self.listCommand.run())
+
+    def test_negative_limit_and_offset(self):
+        AlterUtil.create_alters([1, 2])
+        sys.argv = make_argv(['--limit', '-1'])
+        self.assertRaises(OptionsError, self.listCommand.run)
+        sys.argv = make_argv(['--offset', '-1'])
+        self.assertRaises(OptionsError, self.listCommand.run)
+
+    def test_since(self):
+        ids = AlterUtil.create_alters([1, 2, 3, 4])
+        sys.argv = make_argv(['--since', ids[1]])
+        self.assertEqual(ids[2:], self.listCommand.run())
+        sys.argv = make_argv(['-r', '--since', ids[1], '--limit', '1'])
+        self.assertEqual([ids[3]], self.listCommand.run())
+        sys.argv = make_argv(['--since', ids[3]])
+        self.assertEqual([], self.listCommand.run())
+        sys.argv = make_argv(['--since', '000000000000'])
+        self.assertRaises(MissingRefError, self.listCommand.run)
+
+        # fails before listing anything, in either order
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            for argv in (['-r', '--since', '000000000000'],
+                         ['-r', '--since', '000000000000', '--limit', '1']):
+                sys.argv = make_argv(argv)
+                self.assertRaises(MissingRefError, self.listCommand.run)
+            self.assertEqual(sys.stdout.getvalue(), '')
+        finally:
+            sys.stdout = stdout
+
+    def test_json_lines(self):
+        id1, id2 = AlterUtil.create_alters([1, 2])
+        AlterUtil.run_alters()
+        self.context.db.remove_commit(id2)
+        sys.argv = make_argv(['--format', 'json-lines'])
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.listCommand.run()
+            lines = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        alters = [json.loads(line) for line in lines]
+        self.assertEqual([(a['id'], a['backref'], a['applied']) for a in alters],
+                         [(id1, None, True), (id2, id1, False)])
+
+    def test_order_with_chain_cache(self):
+        context = CommandContext.via({
+          'type': 'memory-db',
+          'chain_cache': '.schema-tool-cache'})
+        listCommand = ListCommand(context)
+        id1, id2 = AlterUtil.create_alters([1, 2])
+        sys.argv = make_argv([])
+        self.assertEqual([id1, id2], listCommand.run())
+        self.assertTrue(os.path.exists(os.path.join(EnvironmentUtil.get_alter_dir(), '.schema-tool-cache')))
+
+        # served (partially) from the cache once it exists
+        id3, = AlterUtil.create_alters([3])
+        sys.argv = make_argv([])
+        self.assertEqual([id1, id2, id3], listCommand.run())
+
+    def test_history_cache(self):
+        context = CommandContext.via({
+          'type': 'memory-db',
+          'history_cache': '.schema-tool-history'})
+        listCommand = ListCommand(context)
+        id1, id2 = AlterUtil.create_alters([1, 2])
+        AlterUtil.run_alters()
+
+        fetches = []
+        fetch_commit_history = context.db.fetch_commit_history
+        def counting_fetch(descending=False):
+            fetches.append(descending)
+            return fetch_commit_history(descending)
+        context.db.fetch_commit_history = counting_fetch
+
+        sys.argv = make_argv([])
+        listCommand.run()
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(context.db.get_applied_alters(), set([id1, id2]))
+        self.assertEqual(len(fetches), 1)
+        self.assertTrue(os.path.exists(os.path.join(EnvironmentUtil.get_alter_dir(), '.schema-tool-history')))
+
+        # read again once the history changes
+        context.db.remove_commit(id2)
+        self.assertEqual(context.db.get_applied_alters(), set([id1]))
+        self.assertEqual([h[1] for h in context.db.get_commit_history(descending=True)], [id1])
+        self.assertEqual(len(fetches), 2)
+
+        # an id reused by another alter, told apart by when it ran
+        MemoryDb.data[-1] = [MemoryDb.data[-1][0], id2, '2026-01-01 00:00:00']
+        self.assertEqual(context.db.get_applied_alters(), set([id2]))
+        self.assertEqual(len(fetches), 3)
+
 
 if __name__ == '__main__':
     unittest.main()
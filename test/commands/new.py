@@ -75,6 +75,39 @@ class NewTest(unittest.TestCase):
         chain_tail = ChainUtil.build_chain()
         self.assertTrue(chain_tail.backref is None)
 
+    def test_creates_proper_alter_chain_with_tail_cache(self):
+        context = CommandContext.via({
+          'type': 'memory-db',
+          'tail_cache': '.schema-tool-tail'})
+        newCommand = NewCommand(context)
+        ids = []
+        for name in ['1', '2', '3']:
+            sys.argv = make_argv(['-f', name])
+            ids.append(newCommand.run())
+            sleep(0.15)
+
+        chain_tail = ChainUtil.build_chain()
+        self.assertEqual(ids[2], chain_tail.id)
+        self.assertEqual(ids[1], chain_tail.backref.id)
+        self.assertEqual(ids[0], chain_tail.backref.backref.id)
+
+    def test_tail_cache_ignored_when_alters_change(self):
+        context = CommandContext.via({
+          'type': 'memory-db',
+          'tail_cache': '.schema-tool-tail'})
+        newCommand = NewCommand(context)
+        sys.argv = make_argv(['-f', '1'])
+        id1 = newCommand.run()
+        sleep(0.15)
+        sys.argv = make_argv(['-f', '2'])
+        id2 = newCommand.run()
+
+        # removing the last alter outside of the tool invalidates the cache
+        for f in ChainUtil.get_alter_files():
+            if f.startswith(id2):
+                os.remove(f)
+        self.assertEqual(id1, ChainUtil.get_tail().id)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+# stdlib imports
+import os
+import sys
+import unittest
+
+# src imports
+import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../schematool')
+sys.path.append(import_path)
+from command import CommandContext, PlanCommand, UpCommand
+from db import MemoryDb
+from errors import MissingRefError, OptionsError
+
+# test util imports
+import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../util')
+sys.path.append(import_path)
+from alter_util import AlterUtil
+from env_util import EnvironmentUtil
+from test_util import make_argv
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        EnvironmentUtil.setup_fresh_test_env()
+        self.context = CommandContext.via({
+          'type': 'memory-db'})
+        self.planCommand = PlanCommand(self.context)
+        self.upCommand = UpCommand(self.context)
+
+    def tearDown(self):
+        EnvironmentUtil.teardown_fresh_test_env()
+
+    def test_in_sync_when_no_alters(self):
+        sys.argv = make_argv([])
+        plan = self.planCommand.run()
+        self.assertTrue(plan['in_sync'])
+        self.assertEqual(plan['apply'], [])
+        self.assertEqual(plan['undo'], [])
+
+    def test_in_sync_when_all_alters_run(self):
+        AlterUtil.create_alters([1, 2])
+        sys.argv = make_argv([])
+        self.upCommand.run()
+        sys.argv = make_argv([])
+        self.assertTrue(self.planCommand.run()['in_sync'])
+
+    def test_apply_lists_alters_not_run_yet(self):
+        ids = AlterUtil.create_alters([1, 2, 3])
+        sys.argv = make_argv(['-n', '1'])
+        self.upCommand.run()
+
+        sys.argv = make_argv([])
+        plan = self.planCommand.run()
+        self.assertFalse(plan['in_sync'])
+        self.assertEqual([a['id'] for a in plan['apply']], ids[1:])
+        for alter in plan['apply']:
+            self.assertTrue(alter['filename'].endswith('-up.sql'))
+            self.assertTrue(alter['size'] > 0)
+            self.assertTrue(alter['should_run'])
+
+        # nothing is run
+        self.assertEqual(len(MemoryDb.data), 1)
+
+    def test_apply_up_to_ref(self):
+        ids = AlterUtil.create_alters([1, 2, 3])
+        sys.argv = make_argv([ids[1]])
+        plan = self.planCommand.run()
+        self.assertEqual([a['id'] for a in plan['apply']], ids[:2])
+
+    def test_ref_raises_when_ref_doesnt_exist(self):
+        AlterUtil.create_alters([1])
+        sys.argv = make_argv(['unknown'])
+        self.assertRaises(MissingRefError, self.planCommand.run)
+
+    def test_down_lists_alters_to_undo(self):
+        ids = AlterUtil.create_alters([1, 2, 3])
+        sys.argv = make_argv([])
+        self.upCommand.run()
+
+        sys.argv = make_argv(['--down', 'base'])
+        plan = self.planCommand.run()
+        self.assertEqual([a['id'] for a in plan['undo']], [ids[2], ids[1]])
+        self.assertTrue(plan['undo'][0]['filename'].endswith('-down.sql'))
+        self.assertEqual(plan['apply'], [])
+        self.assertEqual(len(MemoryDb.data), 3)
+
+    def test_down_requires_argument(self):
+        sys.argv = make_argv(['--down'])
+        self.assertRaises(OptionsError, self.planCommand.run)
+
+
+if __name__ == '__main__':
+    unittest.main()
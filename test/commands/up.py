@@ -1,5 +1,7 @@
 # stdlib imports
+from StringIO import StringIO
 import os
+import random
 import sys
 import unittest
 
@@ -8,7 +10,10 @@ import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../s
 sys.path.append(import_path)
 from command import CommandContext, UpCommand
 from db import MemoryDb
-from errors import MissingRefError, AppliedAlterError
+from db.session import ClientSession
+from errors import DbError, MissingRefError, AppliedAlterError, MissingDownAlterError, MultipleDownAltersError
+from node import SimpleNode
+from util import PlanUtil
 
 # test util imports
 import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../util')
@@ -17,6 +22,112 @@ from env_util import EnvironmentUtil
 from alter_util import AlterUtil
 from test_util import make_argv
 
+# A stand-in for the mysql client: statements end with the current delimiter
+# (outside of quotes), DELIMITER is understood, the marker statement echoes
+# its token and a statement containing 'error' makes it exit.
+STUB_CLIENT = r"""
+import re, sys
+delimiter = ';'
+statement = ''
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    if not statement.strip() and re.match(r'^\s*delimiter\s+(\S+)\s*$', line, re.I):
+        delimiter = line.split()[1]
+        continue
+    statement += line
+    if statement.count("'") % 2 or not statement.rstrip().endswith(delimiter):
+        continue
+    marker = re.search(r"SELECT '(.*)' AS schema_tool_marker", statement)
+    if marker:
+        sys.stdout.write(marker.group(1) + '\n')
+        sys.stdout.flush()
+    elif 'error' in statement:
+        sys.stderr.write('ERROR in statement\n')
+        sys.exit(1)
+    statement = ''
+"""
+
+# A stand-in for psql/vsql: each line is a statement, \echo prints its
+# argument, and output is buffered but flushed before each line is read.
+PSQL_STUB_CLIENT = r"""
+import sys
+while True:
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        break
+    if line.startswith('\\echo '):
+        sys.stdout.write(line[len('\\echo '):])
+    elif line.strip():
+        sys.stdout.write('ran %s' % line)
+"""
+
+def reference_plan_up(tail, history, should_run, target, number, undo, force):
+    """
+    The reconciliation UpCommand did before PlanUtil, recording the alters it
+    would run instead of running them
+    """
+    undone, applied, warnings = [], [], []
+    history = sorted(history, key=lambda h: h[0])
+    history_alters = [h[1] for h in history]
+    alter_list = [tail]
+    if None in alter_list:
+        alter_list.remove(None)
+    while tail is not None and tail.backref is not None:
+        tail = tail.backref
+        alter_list.append(tail)
+
+    common_history = 0
+    for (_, alter_id, _) in history:
+        if len(alter_list) == 0:
+            break
+        alter = alter_list.pop()
+        while not should_run(alter):
+            alter = alter_list.pop()
+        if alter.id == alter_id:
+            common_history += 1
+        else:
+            alter_list.append(alter)
+            break
+
+    if undo:
+        uncommon_history = history[common_history:]
+        uncommon_history.reverse()
+        for (_, alter_id, _) in uncommon_history:
+            alters = [a for a in alter_list if a.id == alter_id]
+            if len(alters) > 1:
+                msg = "Multiple alters found for a single id (%s)" % alter_id
+                if not force:
+                    raise MultipleDownAltersError(msg)
+                warnings.append(msg + "\n")
+            elif len(alters) == 0:
+                raise MissingDownAlterError("Missing down alter %s" % alter_id)
+            undone.append(alters[0].id)
+            if alters[0].id in history_alters:
+                history_alters.remove(alters[0].id)
+
+    if len(alter_list) and target is not None and target not in [a.id for a in alter_list]:
+        raise MissingRefError('revision (%s) not found in alters that would be run' % target)
+
+    max_ = int(number or len(alter_list))
+    i = 0
+    while not len(alter_list) == 0:
+        if i == max_:
+            break
+        alter = alter_list.pop()
+        if target == alter.id:
+            i = (max_ - 1)
+        i += 1
+        if alter.id not in history_alters and should_run(alter):
+            applied.append(alter.id)
+        elif should_run(alter):
+            warnings.append("Warning: alter %s has already been run. Skipping\n" % alter.id)
+
+    return (undone, applied, warnings)
+
+
 class UpTest(unittest.TestCase):
 
     def setUp(self):
@@ -86,6 +197,157 @@ class UpTest(unittest.TestCase):
         self.upCommand.run()
         self.assertEqual(len(MemoryDb.data), 3)
 
+    def test_driver_execution_runs_each_statement(self):
+        context = CommandContext.via({
+          'type': 'memory-db',
+          'execution': 'driver'})
+        id1, = AlterUtil.create_alters([1])
+        up_file = [f for f in os.listdir(EnvironmentUtil.get_alter_dir()) if f.startswith(id1) and 'up' in f][0]
+        alter_file = open(os.path.join(EnvironmentUtil.get_alter_dir(), up_file), 'a')
+        alter_file.write("CREATE TABLE t (s varchar(10) DEFAULT ';');\n-- a comment;\nINSERT INTO t VALUES ('a')")
+        alter_file.close()
+
+        sys.argv = make_argv([])
+        UpCommand(context).run()
+        self.assertEqual(len(MemoryDb.data), 1)
+        self.assertEqual(MemoryDb.statements,
+                         ["CREATE TABLE t (s varchar(10) DEFAULT ';')", "INSERT INTO t VALUES ('a')"])
+
+    def run_in_session(self, alters, timeout=None, client=STUB_CLIENT,
+                       marker="SELECT '%s' AS schema_tool_marker;\n"):
+        """
+        Run the given alters in a session of the given stub client, returning
+        the (success, stdout, stderr) of each
+        """
+        stub = open('stub_client.py', 'w')
+        stub.write(client)
+        stub.close()
+        session = ClientSession([sys.executable, 'stub_client.py'], None, marker, timeout)
+        results = []
+        try:
+            for (i, alter) in enumerate(alters):
+                alter_file = open('alter%d.sql' % i, 'w')
+                alter_file.write(alter)
+                alter_file.close()
+                results.append(session.run('alter%d.sql' % i))
+        finally:
+            session.close()
+        return results
+
+    def test_session_runs_alters_in_one_client(self):
+        results = self.run_in_session(['SELECT 1;\n', 'SELECT 2', '-- nothing\n', 'SELECT error;\n'])
+        self.assertEqual([r[0] for r in results], [True, True, True, False])
+
+    def test_session_resets_delimiter(self):
+        trigger = 'DELIMITER $$\nCREATE TRIGGER t BEGIN SELECT 1; END$$\n'
+        results = self.run_in_session([trigger, 'DELIMITER //\nSELECT 1//\nSELECT 2', 'SELECT 3;\n'],
+                                      timeout=10)
+        self.assertEqual([r[0] for r in results], [True, True, True])
+
+    def test_session_times_out(self):
+        self.assertRaises(DbError, self.run_in_session, ["SELECT 'unterminated;\n"], 1)
+
+    def test_session_output_of_each_alter(self):
+        # the marker comes through the client's buffered output, after that of the alter
+        results = self.run_in_session(['SELECT 1;\n', 'SELECT 2;\nSELECT 3;\n'], timeout=10,
+                                      client=PSQL_STUB_CLIENT, marker='\\echo %s\n')
+        self.assertEqual([r[:2] for r in results],
+                         [(True, 'ran SELECT 1;\n'), (True, 'ran SELECT 2;\nran SELECT 3;\n')])
+
+    def test_new_db_keeps_history(self):
+        AlterUtil.create_alters([1, 2])
+        sys.argv = make_argv([])
+        UpCommand(CommandContext.via({'type': 'memory-db'})).run()
+        db = CommandContext.via({'type': 'memory-db'}).db
+        self.assertEqual(len(db.get_applied_alters()), 2)
+
+    def test_batched_history_records_every_alter(self):
+        context = CommandContext.via({
+          'type': 'memory-db',
+          'history_batch': 2})
+        AlterUtil.create_alters([1, 2, 3])
+        sys.argv = make_argv([])
+        UpCommand(context).run()
+        self.assertEqual(len(MemoryDb.data), 3)
+
+    def test_batched_history_flushed_on_error(self):
+        context = CommandContext.via({
+          'type': 'memory-db',
+          'history_batch': 10})
+        AlterUtil.create_alters([1, 2, 'error', 3])
+        sys.argv = make_argv([])
+        try:
+            UpCommand(context).run()
+        except AppliedAlterError:
+            pass
+        self.assertEqual(len(MemoryDb.data), 2)
+
+    def test_history_error_does_not_hide_alter_error(self):
+        context = CommandContext.via({
+          'type': 'memory-db',
+          'history_batch': 10})
+        def fail(refs):
+            raise DbError('history unavailable')
+        context.db.append_commits = fail
+        AlterUtil.create_alters([1, 'error'])
+        sys.argv = make_argv([])
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertRaises(AppliedAlterError, UpCommand(context).run)
+            self.assertTrue('history unavailable' in sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+
+    def test_plan_matches_reference_on_random_chains(self):
+        rand = random.Random(1234)
+        should_run = lambda alter: alter.require_env is None
+        compared = 0
+        for _ in range(500):
+            tail = None
+            for i in range(rand.randint(0, 30)):
+                node = SimpleNode(id='%04d' % i, filename='%04d-up.sql' % i)
+                if rand.random() < 0.1:
+                    node.require_env = ['prod']
+                node.backref = tail
+                tail = node
+            chain = []
+            node = tail
+            while node is not None:
+                chain.insert(0, node)
+                node = node.backref
+
+            # history is a prefix of the chain followed by divergent entries
+            runnable = [a.id for a in chain if should_run(a)]
+            ids = runnable[:rand.randint(0, len(runnable))]
+            others = [a.id for a in chain if a.id not in ids]
+            ids += rand.sample(others, rand.randint(0, len(others)))
+            if rand.random() < 0.1:
+                ids.append('missing')
+            history = [(n + 1, id, None) for (n, id) in enumerate(ids)]
+            rand.shuffle(history)
+
+            target = rand.choice([None, None, 'missing'] + [a.id for a in chain])
+            number = rand.choice([None, None, rand.randint(1, 10)])
+            undo = rand.random() < 0.8
+            force = rand.random() < 0.5
+
+            try:
+                expected = reference_plan_up(tail, history, should_run, target, number, undo, force)
+            except IndexError:
+                # the old code ran off the end of the chain here
+                continue
+            except Exception, ex:
+                expected = type(ex)
+            try:
+                plan = PlanUtil.plan_up(tail, sorted(history), should_run, target, number, undo, force)
+                actual = ([a.id for a in plan.undo], [a.id for a in plan.apply], plan.warnings)
+            except Exception, ex:
+                actual = type(ex)
+            self.assertEqual(expected, actual)
+            compared += 1
+        self.assertTrue(compared > 400)
+
 
 if __name__ == '__main__':
     unittest.main()
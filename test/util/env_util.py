@@ -9,6 +9,7 @@ import_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../s
 sys.path.append(import_path)
 from command import NewCommand, CommandContext
 from constants import Constants
+from db import MemoryDb
 
 
 class EnvironmentUtil:
@@ -22,6 +23,7 @@ class EnvironmentUtil:
         cls.current_dir = cls.env_folder
 
         Constants.ALTER_DIR = cls.current_dir
+        MemoryDb.reset()
 
     @classmethod
     def teardown_fresh_test_env(cls):